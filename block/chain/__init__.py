@@ -2,21 +2,19 @@
 import operator as op
 import functools
 import itertools
+import threading
+import heapq
+import pickle
 
-from zope.interface import implementer, provider
-from block.chain.interfaces import (
-    IQuery,
-    IFalsyValue,
-    IAnySupport,
-    IExecuteFlavor,
-    IVirtualAccess,
-    ) 
+from block.chain.declarations import implementer, provider
 from block.chain.monoid.mutable import Failure as MFailure
 from block.chain.monoid.immutable import Failure as IMFailure
+from block.chain.monoid import accumulator
+from block.chain.sink import Sink, Window, DEFAULT_WINDOW
 Failure = MFailure
 
 ### Wrapped value
-@implementer(IFalsyValue)
+@implementer("IFalsyValue")
 class _Nothing(object):
     def __nonzero__(self):
         return False
@@ -24,9 +22,9 @@ class _Nothing(object):
 Nothing = _Nothing()
 ### Access registration
 
-IdentityAccess = provider(IVirtualAccess)(op)
+IdentityAccess = provider("IVirtualAccess")(op)
  
-@implementer(IVirtualAccess)
+@implementer("IVirtualAccess")
 class BoundAccess(object):
     def __init__(self,o):
         self.o = o
@@ -42,7 +40,7 @@ class BoundAccess(object):
             return getattr(self.o, k)(v, *args, **kwargs)
         return wrapped
 
-@provider(IVirtualAccess)
+@provider("IVirtualAccess")
 class WrappedAccess(object):
     @staticmethod
     def attrgetter(k):
@@ -63,81 +61,508 @@ class WrappedAccess(object):
         return wrapped
 
 
-@implementer(IQuery)
+def typed_key(x):
+    """ hashable key of x, distinguishing equal values of different types (such as 1, 1.0 and True).
+    tuples are keyed element-wise
+    """
+    if x.__class__ is tuple:
+        return (tuple, tuple([typed_key(e) for e in x]))
+    return (x.__class__, x)
+
+
+ATTR, ITEM, CALL, CONST = "attr", "item", "call", "const"
+
+def _path_getter(access, entry):
+    kind, k = entry[0], entry[1]
+    if kind is ATTR:
+        return access.attrgetter(k)
+    elif kind is ITEM:
+        return access.itemgetter(k)
+    elif kind is CALL:
+        return access.methodcaller(k, *entry[2], **dict(entry[3]))
+    else:
+        return lambda _, : k
+
+def _compose(getters):
+    if len(getters) == 1:
+        return getters[0]
+    def composed(o):
+        for f in getters:
+            o = f(o)
+        return o
+    return composed
+
+def compile_path(path, access=IdentityAccess):
+    """ a function getting the value of path from an object.
+    on IdentityAccess, successive attributes become one op.attrgetter("x.y.z")
+    """
+    if not path:
+        return lambda o : o
+    if access is not IdentityAccess:
+        return _compose([_path_getter(access, e) for e in path])
+    getters = []
+    dotted = []
+    for e in path:
+        if e[0] is ATTR and isinstance(e[1], basestring) and "." not in e[1]:
+            dotted.append(e[1])
+            continue
+        if dotted:
+            getters.append(op.attrgetter(".".join(dotted)))
+            dotted = []
+        getters.append(_path_getter(access, e))
+    if dotted:
+        getters.append(op.attrgetter(".".join(dotted)))
+    return _compose(getters)
+
+_compiled_paths = {}
+_compiled_paths_maxsize = 1024
+
+class WrappedPath(object):
+    """ step function (ctx, v) getting the value of path, lifted on ctx at once"""
+    __slots__ = ["path", "getter"]
+    def __init__(self, path):
+        self.path = path
+        self.getter = compiled_path(path)
+
+    def __call__(self, ctx, v):
+        return ctx.lifted(self.getter, v)
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and typed_key(self.path) == typed_key(other.path)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, self.path))
+
+    def __reduce__(self):
+        return (self.__class__, (self.path, ))
+
+def compiled_path(path):
+    """ compile_path on IdentityAccess, cached by path and the types of its keys (except paths having constants).
+    the cache is cleared when it has _compiled_paths_maxsize paths
+    """
+    if any(e[0] is CONST for e in path):
+        return compile_path(path)
+    try:
+        key = typed_key(path)
+        return _compiled_paths[key]
+    except KeyError:
+        if len(_compiled_paths) >= _compiled_paths_maxsize:
+            _compiled_paths.clear()
+        getter = _compiled_paths[key] = compile_path(path)
+        return getter
+    except TypeError:  # unhashable arguments
+        return compile_path(path)
+
+
+@implementer("IQuery")
 class VirtualObject(object):
-    def __init__(self, access=IdentityAccess):
+    """ immutable access path. each access returns a new VirtualObject.
+    _path is a tuple of (kind, key[, args, kwargs]), so a VirtualObject is hashable (iff its arguments are).
+    (public names are avoided as far as possible, because they cannot be accessed as a path)
+    """
+    __slots__ = ["access", "_path", "_q", "_getter"]
+    def __init__(self, access=IdentityAccess, path=()):
         self.access = access
-        self.q = []
-        self.names = []
+        self._path = path
+        self._q = None
+        self._getter = None
+
+    def _extend(self, entry):
+        return self.__class__(self.access, self._path + (entry, ))
 
     def __getattr__(self, k):
-        self.q.append(self.access.attrgetter(k))
-        self.names.append(k)
-        return self
+        return self._extend((ATTR, k))
 
     def __getitem__(self, k):
-        self.q.append(self.access.itemgetter(k))
-        self.names.append(k)
-        return self
+        return self._extend((ITEM, k))
 
     def __iter__(self):
         return iter(self.q)
 
     def __call__(self, *args, **kwargs):
-        self.q.pop()
-        k = self.names[-1]
-        self.q.append(self.access.methodcaller(k,*args,**kwargs))
-        return self
+        kind, k = self._path[-1][:2]
+        entry = (CALL, k, args, tuple(sorted(kwargs.items())))
+        return self.__class__(self.access, self._path[:-1] + (entry, ))
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and
+                self.access is other.access and typed_key(self._path) == typed_key(other._path))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, id(self.access), typed_key(self._path)))
+
+    def __reduce__(self):
+        ## IdentityAccess (operator module) is not picklable
+        access = None if self.access is IdentityAccess else self.access
+        return (_virtual_object, (self.__class__, access, self._path))
+
+    def __repr__(self):
+        return "<{0} {1!r}>".format(self.__class__.__name__, self.names)
+
+    @property
+    def q(self):
+        if self._q is None:
+            self._q = tuple(_path_getter(self.access, e) for e in self._path)
+        return self._q
+
+    @property
+    def names(self):
+        return [e[2] if e[0] is CONST else e[1] for e in self._path]
 
     def _const(self, v, name="*const*"):
-        self.q.append(lambda _, : v)
-        self.names.append(name)
-        return self
-    
+        return self._extend((CONST, v, name))
+
+    def _compile(self):
+        """ function getting the value of this path from an object"""
+        if self._getter is None:
+            if self.access is IdentityAccess:
+                self._getter = compiled_path(self._path)
+            else:
+                self._getter = compile_path(self._path, self.access)
+        return self._getter
+
     def value(self, o=None):
-        return functools.reduce(lambda v, f:f(v), self, o)
+        return self._compile()(o)
 
+def _virtual_object(cls, access, path):
+    return cls(IdentityAccess if access is None else access, path)
 
 ### Chain
-@implementer(IQuery)
+DO, DO_MANY, MAP, DIRECT = "do", "do*", "map", "direct"
+
+class Step(object):
+    """ a step of ChainedQuery, called as step(ctx, v)"""
+    __slots__ = ["f", "args", "__weakref__"]
+    kind = None
+    def __init__(self, f, args=()):
+        self.f = f
+        self.args = args
+
+    def __repr__(self):
+        return "<{0} {1!r} {2!r}>".format(self.kind, self.f, self.args)
+
+    def __reduce__(self):
+        return (self.__class__, (self.f, self.args))
+
+class DoStep(Step):
+    __slots__ = []
+    kind = DO
+    def __call__(self, ctx, v, *args, **kwargs):
+        return ctx.bind(v, self.f, *args, **kwargs)
+
+class DoManyStep(Step):
+    __slots__ = []
+    kind = DO_MANY
+    def __call__(self, ctx, v, *args, **kwargs):
+        for f in self.f:
+            v = ctx.bind(v, f, *args, **kwargs)
+        return v
+
+class MapStep(Step):
+    __slots__ = []
+    kind = MAP
+    def __call__(self, ctx, v):
+        return ctx.map(self.f, v, *self.args)
+
+class DirectStep(Step):
+    __slots__ = []
+    kind = DIRECT
+    def __call__(self, ctx, v, *args, **kwargs):
+        if ctx.settling:
+            v = ctx.settle(v)
+        return self.f(ctx, v, *args, **kwargs)
+
+_steps_lock = threading.Lock()
+
+class Steps(object):
+    """ persistent list of steps. appending is O(1), and appended lists share their prefix.
+    materialized steps are kept in a list shared along a chain of appends
+    (buffer()[:size] are the steps of a node), so materializing every prefix of a chain is O(N).
+    """
+    __slots__ = ["head", "tail", "size", "_buffer"]
+    def __init__(self, head=None, tail=None):
+        self.head = head
+        self.tail = tail
+        self.size = 0 if tail is None else tail.size + 1
+        self._buffer = None if tail is not None else []
+
+    @classmethod
+    def from_iterable(cls, steps):
+        r = EMPTY_STEPS
+        for step in steps:
+            r = r.append(step)
+        return r
+
+    def append(self, step):
+        return self.__class__(step, self)
+
+    def buffer(self):
+        """ list starting with the steps of this node (don't modify it).
+        the list of the nearest materialized ancestor is extended in place if it ends at the ancestor,
+        otherwise (another branch extended it) its prefix is copied.
+        """
+        if self._buffer is None:
+            nodes = []
+            node = self
+            while node._buffer is None:
+                nodes.append(node)
+                node = node.tail
+            nodes.reverse()
+            with _steps_lock:
+                buf = node._buffer
+                if node.size == 0 or len(buf) != node.size:
+                    buf = buf[:node.size]
+                buf.extend(n.head for n in nodes)
+                for n in nodes:
+                    n._buffer = buf
+        return self._buffer
+
+    def items(self):
+        """ steps in order (tuple)"""
+        return tuple(itertools.islice(self.buffer(), self.size))
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return itertools.islice(self.buffer(), self.size)
+
+    def __getitem__(self, i):
+        return self.items()[i]
+
+EMPTY_STEPS = Steps()
+
+def lower_steps(steps, decompose=False):
+    """ (kind, f, args) triples, used by compiled runners.
+    if decompose, composed maps (see ChainedQuery.optimize) are split into each map.
+    """
+    if not decompose:
+        return tuple((s.kind, s.f, s.args) for s in steps)
+    plan = []
+    for s in steps:
+        if s.kind is MAP and isinstance(s.f, Composed):
+            plan.extend((MAP, f, ()) for f in s.f.fs)
+        else:
+            plan.append((s.kind, s.f, s.args))
+    return tuple(plan)
+
+STEP_CLASSES = {DO: DoStep, DO_MANY: DoManyStep, MAP: MapStep, DIRECT: DirectStep}
+
+def raise_steps(spec):
+    """ steps from (kind, f, args) triples. (the inverse of lower_steps)"""
+    return Steps.from_iterable(STEP_CLASSES[kind](f, args) for kind, f, args in spec)
+
+_rebuilt = {}
+_rebuilt_maxsize = 256
+
+def _rebuild_query(cls, spec):
+    """ unpickling ChainedQuery. the query is cached by its spec (pickled again, so arguments equal
+    but of different types such as 2 and 2.0 are not shared), so a worker receiving the same pipeline
+    many times reuses the query (and its compiled runners).
+    """
+    try:
+        key = (cls, pickle.dumps(spec, pickle.HIGHEST_PROTOCOL))
+        return _rebuilt[key]
+    except KeyError:
+        if len(_rebuilt) >= _rebuilt_maxsize:
+            _rebuilt.clear()
+        q = _rebuilt[key] = cls(raise_steps(spec))
+        return q
+    except (pickle.PicklingError, TypeError):
+        return cls(raise_steps(spec))
+
+def _finished(runner, ctx, init, *args, **kwargs):
+    return ctx.finish(runner(ctx, init, *args, **kwargs))
+
+def _value_chunk(arguments):
+    q, ctx, inits = arguments
+    run = q.compile(ctx)
+    return [run(v) for v in inits]
+
+@implementer("IQuery")
 class ChainedQuery(object):
-    def __init__(self,  fs=None):
-        self.fs = fs or []
+    stats = None  # block.chain.stats.Registry, recording each step of value() if set
 
-    def do(self,  *fs):
-        fs_ = self.fs[:]
+    def __init__(self,  fs=None):
+        if not isinstance(fs, Steps):
+            fs = Steps.from_iterable(fs or ())
+        self.fs = fs
+        self._compiled = {}
+
+    def do(self,  *fs, **options):
+        """ options: memo, True or options of block.chain.memo.memoize (such as {"maxsize": 1024})"""
+        memo = options.pop("memo", None)
+        if options:
+            raise TypeError("unexpected options: {0}".format(", ".join(options)))
+        fs_ = self.fs
         for f in fs:
-            if hasattr(f, "__iter__"):
-                def _do(ctx, v, *args, **kwargs):
-                    for subf in f:
-                        v = ctx.bind(v, subf, *args, **kwargs)
-                    return v
-                fs_.append(_do)
+            if memo and not hasattr(f, "__iter__"):
+                from block.chain.memo import memoize
+                f = memoize(f, **(memo if isinstance(memo, dict) else {}))
+            if isinstance(f, VirtualObject) and f.access is WrappedAccess and f._path:
+                fs_ = fs_.append(DoStep(WrappedPath(f._path)))
+            elif hasattr(f, "__iter__"):
+                fs_ = fs_.append(DoManyStep(tuple(f)))
             else:
-                def _do(ctx, v, *args, **kwargs):
-                    return ctx.bind(v, f, *args, **kwargs)
-                fs_.append(_do)
+                fs_ = fs_.append(DoStep(f))
         return self.__class__(fs_)
 
     def map(self, f, *args):
-        fs_ = self.fs[:]
-        def _map(ctx, v):
-            return ctx.map(f, v, *args)
-        fs_.append(_map)
-        return self.__class__(fs_)
+        return self.__class__(self.fs.append(MapStep(f, args)))
 
     def value(self,  ctx,  init,  *args,  **kwargs):
+        if self.stats is not None:
+            return self.stats.run(self, ctx, init, *args, **kwargs)
         if not self.fs:
-            return init
-        v = self.fs[0](ctx, init, *args, **kwargs)
-        for f in self.fs[1:]:
-            v = f(ctx, v)
+            v = init
+        else:
+            steps = iter(self.fs)
+            v = next(steps)(ctx, init, *args, **kwargs)
+            for f in steps:
+                v = f(ctx, v)
+        if ctx.finishing:
+            v = ctx.finish(v)
         return v
 
+    def value_many(self, ctx, inits):
+        """ value() over many inputs at once, see block.chain.batch"""
+        from block.chain.batch import value_many
+        return value_many(self, ctx, inits)
+
+    def compile(self, ctx):
+        """ specialized runner for ctx's flavor. compile(ctx)(init) == value(ctx, init).
+        compiled runners are cached per flavor class.
+        """
+        if self.stats is not None:
+            return functools.partial(self.stats.run, self, ctx)
+        runner = self._compiled.get(ctx.__class__)
+        if runner is None:
+            runner = self._compiled[ctx.__class__] = ctx.compile_steps(self.fs.items())
+        if ctx.finishing:
+            return functools.partial(_finished, runner, ctx)
+        return functools.partial(runner, ctx)
+
     def direct(self, f):
-        fs_ = self.fs[:]
-        fs_.append(f)
-        return self.__class__(fs_)
+        return self.__class__(self.fs.append(DirectStep(f)))
+
+    def spec(self):
+        """ declarative form of the steps, ((kind, f, args), ...). pickled instead of the steps"""
+        return lower_steps(self.fs.items())
+
+    def __reduce__(self):
+        return (_rebuild_query, (self.__class__, self.spec()))
+
+    def optimize(self):
+        """ equivalent query with fewer steps, see block.chain.optimize"""
+        from block.chain.optimize import optimize
+        return optimize(self)
+
+    def value_parallel(self, ctx, inits, executor, chunksize=1024):
+        """ value() over many inputs on a process pool (anything having map(fn, iterable) keeping order).
+        the query and ctx are pickled once per chunk, so functions must be defined on module level
+        (chain(f, ...), chain.x.y and Any of them are picklable).
+        """
+        inits = list(inits)
+        chunks = [(self, ctx, inits[i:i + chunksize]) for i in range(0, len(inits), chunksize)]
+        r = []
+        for vs in executor.map(_value_chunk, chunks):
+            r.extend(vs)
+        return r
+
+class Lifted(object):
+    """ step function (ctx, v) applying f lifted on ctx. picklable iff f and arguments are"""
+    __slots__ = ["f", "args", "kwargs"]
+    def __init__(self, f, args=(), kwargs=None):
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs or {}
+
+    def __call__(self, ctx, v):
+        return ctx.lifted(self.f, v, *self.args, **self.kwargs)
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and self.f == other.f and
+                typed_key((self.args, tuple(sorted(self.kwargs.items())))) ==
+                typed_key((other.args, tuple(sorted(other.kwargs.items())))))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, self.f, self.args, tuple(sorted(self.kwargs.items()))))
+
+    def __reduce__(self):
+        return (self.__class__, (self.f, self.args, self.kwargs))
+
+    def __repr__(self):
+        return "<Lifted {0!r} {1!r} {2!r}>".format(self.f, self.args, self.kwargs)
+
+def identity(x):
+    """ map step doing nothing, dropped by ChainedQuery.optimize()"""
+    return x
+
+_COMPOSITION = """
+def composed(x):
+{0}
+    return x
+
+def over(xs):
+    return [{1} for x in xs]
+"""
+_COMPOSITION_DEPTH = 32  # calls nested in an expression (the parser overflows on deep nesting)
+
+def _composition(fs):
+    """ functions x -> f_n(...f_1(f_0(x))) and xs -> [f_n(...f_1(f_0(x))) for x in xs], without loop.
+    the calls are nested by at most _COMPOSITION_DEPTH, in successive assignments
+    """
+    names = ["f{0}".format(i) for i in range(len(fs))]
+    lines = []
+    for i in range(0, len(names), _COMPOSITION_DEPTH):
+        body = "x"
+        for name in names[i:i + _COMPOSITION_DEPTH]:
+            body = "{0}({1})".format(name, body)
+        lines.append(body)
+    namespace = dict(zip(names, fs))
+    element = lines[0] if len(lines) == 1 else "composed(x)" if lines else "x"
+    exec(_COMPOSITION.format("\n".join("    x = " + line for line in lines), element), namespace)
+    return namespace["composed"], namespace["over"]
+
+class Composed(functools.partial):
+    """ composition of single argument functions, applied in order. made by ChainedQuery.optimize().
+    flavors checking values between maps (MaybeF, ErrorF, AsyncF) apply each function in turn.
+    """
+    def __new__(cls, fs):
+        fs = tuple(fs)
+        composed, over = _composition(fs)
+        self = functools.partial.__new__(cls, composed)
+        self.fs = fs
+        self.over = over  # mapping over a list at once
+        return self
+
+    @property
+    def __name__(self):
+        return "|".join(getattr(f, "__name__", f.__class__.__name__) for f in self.fs)
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.fs == other.fs
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, self.fs))
+
+    def __reduce__(self):
+        return (self.__class__, (self.fs, ))
+
+    def __repr__(self):
+        return "<Composed {0!r}>".format(self.fs)
 
 class OnContextChainedQueryFactory(object):
     def __init__(self, vo_factory):
@@ -152,9 +577,12 @@ class OnContextChainedQueryFactory(object):
         return vo[k]
 
     def __call__(self,  f,  *args,  **kwargs):
-        def wrapped(ctx,v):
-            return ctx.lifted(f, v, *args, **kwargs)
-        return wrapped
+        return Lifted(f, args, kwargs)
+
+    def memoize(self, f, maxsize=128, ttl=None, cache_failures=False):
+        """ do step caching f(ctx, v), see block.chain.memo"""
+        from block.chain.memo import memoize
+        return memoize(f, maxsize=maxsize, ttl=ttl, cache_failures=cache_failures)
 
     @property
     def chain(self):
@@ -165,22 +593,54 @@ chain = OnContextChainedQueryFactory(functools.partial(VirtualObject, WrappedAcc
 
 ### Any
 class Any(object):
+    """ alternatives. the first not failed one is chosen (failures are accumulated by choice_another).
+    alternatives are evaluated lazily in order, and the rest are not evaluated after a success.
+
+    as a value (argument of map, input of a step), alternatives are
+      values (also callables), Thunk and ctx.chain(...) (exceptions become failures),
+      ChainedQuery (evaluated from None).
+    as a do step (chain.chain.do(Any(...))), alternatives are
+      values, step functions f(ctx, v), ChainedQuery (evaluated from v).
+    """
     def __init__(self, *fs):
         self.fs = fs
 
     def empty(self, ctx):
         return ctx.failure(None) #xxx:
 
-    def choice(self, ctx):
-        f = self.fs[0]
+    def _first(self, ctx, values):
+        values = iter(values)
+        f = next(values)
         if not ctx.is_failure(f):
             return f
-        for g in self.fs[1:]:
+        for g in values:
             f = ctx.choice_another(f, g)
             if not ctx.is_failure(f):
                 return f
         return f
 
+    def _evaluate(self, ctx, f):
+        if isinstance(f, ChainedQuery):
+            return f.value(ctx, None)
+        if isinstance(f, Any):  # callable as a do step, but a value here
+            return f.choice(ctx)
+        if _is_thunk(f):
+            return ctx.lifted(lambda _: _evaluate(f), None)
+        return f
+
+    def _apply(self, ctx, f, v, args, kwargs):
+        if isinstance(f, ChainedQuery):
+            return f.value(ctx, v, *args, **kwargs)
+        if callable(f):
+            return f(ctx, v, *args, **kwargs)
+        return f
+
+    def choice(self, ctx):
+        return self._first(ctx, (self._evaluate(ctx, f) for f in self.fs))
+
+    def __call__(self, ctx, v, *args, **kwargs):
+        return self._first(ctx, (self._apply(ctx, f, v, args, kwargs) for f in self.fs))
+
 ### Executing Flavors
 class Context(object):
     def chain(self, init):
@@ -196,8 +656,78 @@ class Context(object):
             return self.choice_another(f, g)
         return f
 
-@implementer(IExecuteFlavor, IAnySupport)
+    ## if finishing, finish(v) is applied to the result of a query (value(), compile(), QuerySet),
+    ## not to intermediate values (runners of compile_steps)
+    finishing = False
+
+    def finish(self, v):
+        return v
+
+    ## if settling, settle(v) is applied to the value passed to a direct step
+    ## (flavors keeping intermediate values in an internal form build the value here)
+    settling = False
+
+    def settle(self, v):
+        return v
+
+    def fork(self, v):
+        """ v for another branch of computation (see block.chain.queryset).
+        flavors updating their values in place return a copy.
+        """
+        return v
+
+    def branches(self, v, n):
+        """ n values of v for n branches of computation. fork(v) for all but the last one, taking v itself.
+        flavors whose values can be consumed only once (iterators) override this.
+        """
+        return [self.fork(v) for _ in range(n - 1)] + [v]
+
+    @classmethod
+    def compile_steps(cls, steps):
+        """ runner(ctx, init, *args, **kwargs), calling step by step.
+        flavors override this with a specialized loop.
+        (a subclass changing bind/map must also override this)
+        """
+        if not steps:
+            return lambda ctx, init, *args, **kwargs: init
+        first, rest = steps[0], steps[1:]
+        def run(ctx, init, *args, **kwargs):
+            v = first(ctx, init, *args, **kwargs)
+            for f in rest:
+                v = f(ctx, v)
+            return v
+        return run
+
+class Thunk(object):
+    """ f(*args, **kwargs) given as an argument of map, evaluated when the map is applied
+    (concurrently on the executor of the flavor if given). other callables are passed as they are.
+
+      chain.chain.map(lambda x, y: x + y, Thunk(fetch, url))
+    """
+    __slots__ = ["f", "args", "kwargs"]
+    def __init__(self, f, *args, **kwargs):
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return self.f(*self.args, **self.kwargs)
+
+def _evaluate(e):
+    if isinstance(e, VirtualObject):
+        return e.value()
+    return e()
+
+def _is_thunk(e):
+    return isinstance(e, (Thunk, VirtualObject))
+
+@implementer("IExecuteFlavor", "IAnySupport")
 class MaybeF(Context):
+    failure_types = (_Nothing, )
+
+    def __init__(self, executor=None):
+        self.executor = executor
+
     def failure(self, *args):
         return Nothing
 
@@ -221,6 +751,10 @@ class MaybeF(Context):
             return self.failure(e)
 
     def map(self, f, v, *args):
+        if isinstance(f, Composed) and not args:
+            for g in f.fs:
+                v = self.map(g, v)
+            return v
         v = self.choice(v)
 
         if self.is_failure(v):
@@ -229,32 +763,106 @@ class MaybeF(Context):
             return f(v)
 
         args_ = []
-        for e in args:
+        for e in self.evaluate_arguments(args):
             args_.append(self.choice(e))
             if self.is_failure(e):
                 return e
         return f(v, *args_)
 
-@implementer(IExecuteFlavor, IAnySupport)
+    def evaluate_arguments(self, args):
+        """ the arguments of map being Thunk or VirtualObject (ctx.chain(...)) are evaluated.
+        exceptions become failures. with executor, they are evaluated concurrently on it.
+        """
+        if self.executor is None:
+            if any(_is_thunk(e) for e in args):
+                return [self.lifted(_evaluate, e) if _is_thunk(e) else e for e in args]
+            return args
+        futures = [self.executor.submit(self.lifted, _evaluate, e) if _is_thunk(e) else None
+                   for e in args]
+        return [e if future is None else future.result() for e, future in zip(args, futures)]
+
+    @classmethod
+    def compile_steps(cls, steps):
+        failure_types = cls.failure_types
+        plan = lower_steps(steps, decompose=True)  # values are checked between maps
+        n = len(plan)
+        ## after a failure, only direct steps and map with arguments (failures are accumulated)
+        ## can see the value. so jump to the next one of them.
+        resume = [n] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            kind, _, extra = plan[i]
+            resume[i] = i if kind is DIRECT or (kind is MAP and extra) else resume[i + 1]
+
+        def run(ctx, v, *args, **kwargs):
+            i = 0
+            while i < n:
+                kind, f, extra = plan[i]
+                i += 1
+                if kind is DIRECT:
+                    v = f(ctx, v, *args, **kwargs)
+                elif extra:
+                    v = ctx.map(f, v, *extra)
+                else:
+                    if isinstance(v, Any):
+                        v = v.choice(ctx)
+                    if isinstance(v, failure_types):
+                        i = resume[i]
+                    elif kind is DO:
+                        v = f(ctx, v, *args, **kwargs)
+                    elif kind is MAP:
+                        v = f(v)
+                    else:
+                        for g in f:
+                            if isinstance(v, Any):
+                                v = v.choice(ctx)
+                            if isinstance(v, failure_types):
+                                break
+                            v = g(ctx, v, *args, **kwargs)
+                if args or kwargs:
+                    args, kwargs = (), {}
+            return v
+        return run
+
+@implementer("IExecuteFlavor", "IAnySupport")
 class ErrorF(MaybeF):
-    def __init__(self, mutable=True):
+    failure_types = (IMFailure, MFailure)
+
+    def __init__(self, mutable=True, executor=None, policy=None):
+        MaybeF.__init__(self, executor)
         if mutable:
             self.Failure = MFailure
         else:
             self.Failure = IMFailure
+        self.policy = policy  # block.chain.capture.CapturePolicy
 
     def failure(self,  v):
+        if self.policy is not None:
+            return self.policy.truncated(self.Failure(self.policy.capture(v)))
         return self.Failure(v)
 
+    def truncated(self, failure):
+        if self.policy is not None:
+            return self.policy.truncated(failure)
+        return failure
+
     def choice_another(self, f, g):
         if self.is_failure(g):
-            return f.append(g)
+            return self.truncated(f.append(g))
         return g           
 
     def is_failure(self, x):
         return not bool(x) and isinstance(x, (IMFailure, MFailure)) #xxx:
 
+    def fork(self, v):
+        if isinstance(v, MFailure):
+            return v.copy()
+        return v
+
     def map(self, f, v, *args):
+        if isinstance(f, Composed) and not args:
+            for g in f.fs:
+                v = self.map(g, v)
+            return v
         v = self.choice(v)
 
         args_ = []
@@ -265,68 +873,423 @@ class ErrorF(MaybeF):
                 return v
             return f(v)
 
+        fail_fast = self.policy is not None and self.policy.fail_fast
         if self.is_failure(v):
+            if fail_fast:
+                return v
             failures.append(v)
 
-        for e in args:
+        for e in self.evaluate_arguments(args):
             e = self.choice(e)
             args_.append(e)
             if self.is_failure(e):
+                if fail_fast:
+                    return e
                 failures.append(e)
+        if len(failures) == 1:
+            return failures[0]
         if failures:
-            return functools.reduce(self.choice_another, failures)
+            return self.truncated(failures[0].__class__.mconcat(failures))
         return f(v, *args_)
 
-@implementer(IExecuteFlavor)
+class StateAction(object):
+    """ state action (s -> (s, v)) built by StateF.bind and StateF.map.
+    calling it runs the chain of actions as a flat loop (the flattened chain is memoized),
+    so the stack depth does not grow with the length of the chain.
+    """
+    __slots__ = ["ctx", "ma", "f", "args", "kwargs", "_plan"]
+    is_map = False
+    def __init__(self, ctx, ma, f, args=(), kwargs=None):
+        self.ctx = ctx
+        self.ma = ma
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self._plan = None
+
+    def flatten(self):
+        """ (initial action, ((is_map, ctx, f, args, kwargs, cell_step), ...))"""
+        if self._plan is None:
+            actions = []
+            ma = self
+            while isinstance(ma, StateAction) and ma._plan is None:
+                actions.append(ma)
+                ma = ma.ma
+            if isinstance(ma, StateAction):
+                base, plan = ma._plan
+            else:
+                base, plan = ma, ()
+            actions.reverse()
+            self._plan = (base, plan + tuple((a.is_map, a.ctx, a.f, a.args, a.kwargs,
+                                              getattr(a.f, "cell_step", None)) for a in actions))
+        return self._plan
+
+    def __call__(self, s):
+        if self.ctx.cell:
+            return self.run_on_cell(Cell(s))
+        base, plan = self._plan or self.flatten()
+        s, v = base(s)
+        for is_map, ctx, f, args, kwargs, _ in plan:
+            if is_map:
+                if args:
+                    arguments = [v]
+                    for mx in args:
+                        s, x = mx(s)
+                        arguments.append(x)
+                    v = f(*arguments)
+                else:
+                    v = f(v)
+            elif args or kwargs:
+                s, v = f(ctx, v, *args, **kwargs)(s)
+            else:
+                s, v = f(ctx, v)(s)
+        return s, v
+
+    def run_on_cell(self, cell):
+        """ running with the state in cell. steps having cell_step update the cell directly"""
+        base, plan = self._plan or self.flatten()
+        cell.s, v = base(cell.s)
+        for is_map, ctx, f, args, kwargs, cell_step in plan:
+            if is_map:
+                if args:
+                    arguments = [v]
+                    for mx in args:
+                        cell.s, x = mx(cell.s)
+                        arguments.append(x)
+                    v = f(*arguments)
+                else:
+                    v = f(v)
+            elif cell_step is None:
+                cell.s, v = f(ctx, v, *args, **kwargs)(cell.s)
+            elif args or kwargs:
+                v = cell_step(ctx, cell, v, *args, **kwargs)
+            else:
+                v = cell_step(ctx, cell, v)
+        return cell.s, v
+
+class Cell(object):
+    """ mutable state of StateF(cell=True) during a run"""
+    __slots__ = ["s"]
+    def __init__(self, s):
+        self.s = s
+
+class BindAction(StateAction):
+    __slots__ = []
+
+class MapAction(StateAction):
+    __slots__ = []
+    is_map = True
+
+@implementer("IExecuteFlavor", "IAnySupport")
+class AsyncF(ErrorF):
+    """ ErrorF whose values may be futures (concurrent.futures API).
+    steps may return futures, and bind/map (so ChainedQuery.value) return a future.
+    waiting is done by callbacks, so arguments of map are awaited concurrently.
+    exceptions raised in futures or steps become failures, like lifted (also at the last step).
+    Thunk arguments of map are submitted to the executor, and awaited by callbacks as well.
+    """
+    def __init__(self, executor=None, mutable=True):
+        from concurrent.futures import Future
+        ErrorF.__init__(self, mutable)
+        self.executor = executor
+        self.Future = Future
+
+    def submit(self, fn, *args, **kwargs):
+        """ run fn on the executor, as a future. without executor, fn is run inline."""
+        if self.executor is not None:
+            return self.executor.submit(fn, *args, **kwargs)
+        future = self.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def is_future(self, v):
+        return hasattr(v, "add_done_callback")
+
+    def resolved(self, v):
+        if self.is_future(v):
+            return v
+        future = self.Future()
+        future.set_result(v)
+        return future
+
+    def _forward(self, source, target):
+        def done(source):
+            try:
+                r = source.result()
+            except Exception as e:
+                r = self.failure(e)
+            target.set_result(r)
+        source.add_done_callback(done)
+
+    def gather(self, vs, fn):
+        """ future of fn(values), after all of vs are resolved"""
+        target = self.Future()
+        vs = list(vs)
+        results = [None] * len(vs)
+        remaining = [len(vs)]
+        lock = threading.Lock()
+
+        def finish():
+            try:
+                r = fn(results)
+            except Exception as e:
+                r = self.failure(e)
+            if self.is_future(r):
+                self._forward(r, target)
+            else:
+                target.set_result(r)
+
+        def collect(i):
+            def done(future):
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    results[i] = self.failure(e)
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    finish()
+            return done
+
+        for i, v in enumerate(vs):
+            if self.is_future(v):
+                v.add_done_callback(collect(i))
+            else:
+                collect(i)(self.resolved(v))
+        return target
+
+    def bind(self, ma, f, *args, **kwargs):
+        return self.gather([ma], lambda vs: ErrorF.bind(self, vs[0], f, *args, **kwargs))
+
+    def fork(self, v):
+        if self.is_future(v):
+            return self.gather([v], lambda vs: ErrorF.fork(self, vs[0]))
+        return ErrorF.fork(self, v)
+
+    def evaluate_arguments(self, args):
+        ## thunks are already submitted by map. (waiting for them here blocks in a callback of the executor)
+        return args
+
+    def map(self, f, v, *args):
+        args = [self.submit(self.lifted, _evaluate, e) if _is_thunk(e) else e for e in args]
+        return self.gather([v] + args, lambda vs: ErrorF.map(self, f, *vs))
+
+    @classmethod
+    def compile_steps(cls, steps):
+        return super(MaybeF, cls).compile_steps(steps)
+
+@implementer("IExecuteFlavor")
 class StateF(Context):
+    """ state : s -> (s, v)
+
+    with cell=True, the state lives in a mutable Cell during a run, and steps having
+    cell_step(ctx, cell, v, *args, **kwargs) -> v (such as inc, put, get) update it
+    without allocating a state action and a (s, v) tuple. the result is the same (s, v).
+    """
+    cell = False
+
+    def __init__(self, cell=False):
+        self.cell = cell
+
     def unit(self, v):
         return lambda s : (s,v)
 
     ## state : s -> (s, v)
     ## a -> ma -> ma -> mb
     def bind(self, ma, f, *args, **kwargs):
-        def wrapped(s):
-            s1, v = ma(s)
-            fk = f(self, v, *args, **kwargs)
-            return fk(s1)
-        return wrapped
+        return BindAction(self, ma, f, args, kwargs)
 
     def lifted(self, f, v, *args, **kwargs):
         return self.unit(f(v, *args, **kwargs))
 
     def map(self, f, ma, *args):
-        if not args:
-            def wrapped(s):
-                s, x = ma(s)
-                return (s, f(x))
-        def wrapped_multi(s):
-            s, v = ma(s)
-            arguments = [v]
-            for mx in args:
-                s, v = mx(s)
-                arguments.append(v)
-            return s, f(*arguments)
-        return wrapped_multi
+        return MapAction(self, ma, f, args)
 
     def put(self, mx, n):
         return lambda _: mx(n)
 
+    @classmethod
+    def compile_steps(cls, steps):
+        if any(s.kind is DIRECT for s in steps):
+            ## direct steps take the state action itself
+            return super(StateF, cls).compile_steps(steps)
+        plan = lower_steps(steps)
+        cell_plan = tuple((kind, f, extra, tuple(getattr(g, "cell_step", None) for g in f)
+                           if kind is DO_MANY else getattr(f, "cell_step", None))
+                          for kind, f, extra in plan)
+
+        def run_on_cell(ctx, ma, args, kwargs, cell):
+            cell.s, v = ma(cell.s)
+            for kind, f, extra, cell_step in cell_plan:
+                if kind is DO:
+                    if args or kwargs:
+                        if cell_step is not None:
+                            v = cell_step(ctx, cell, v, *args, **kwargs)
+                        else:
+                            cell.s, v = f(ctx, v, *args, **kwargs)(cell.s)
+                        args, kwargs = (), {}
+                    elif cell_step is not None:
+                        v = cell_step(ctx, cell, v)
+                    else:
+                        cell.s, v = f(ctx, v)(cell.s)
+                elif kind is MAP:
+                    if extra:
+                        arguments = [v]
+                        for mx in extra:
+                            cell.s, x = mx(cell.s)
+                            arguments.append(x)
+                        v = f(*arguments)
+                    else:
+                        v = f(v)
+                else:
+                    for g, g_cell_step in zip(f, cell_step):
+                        if g_cell_step is not None:
+                            v = g_cell_step(ctx, cell, v, *args, **kwargs)
+                        else:
+                            cell.s, v = g(ctx, v, *args, **kwargs)(cell.s)
+                    args, kwargs = (), {}
+            return cell.s, v
+
+        def run(ctx, ma, *args, **kwargs):
+            if ctx.cell:
+                return lambda s: run_on_cell(ctx, ma, args, kwargs, Cell(s))
+
+            def action(s):
+                s, v = ma(s)
+                a, kw = args, kwargs
+                for kind, f, extra in plan:
+                    if kind is DO:
+                        if a or kw:
+                            s, v = f(ctx, v, *a, **kw)(s)
+                            a, kw = (), {}
+                        else:
+                            s, v = f(ctx, v)(s)
+                    elif kind is MAP:
+                        if extra:
+                            arguments = [v]
+                            for mx in extra:
+                                s, x = mx(s)
+                                arguments.append(x)
+                            v = f(*arguments)
+                        else:
+                            v = f(v)
+                    else:
+                        for g in f:
+                            s, v = g(ctx, v, *a, **kw)(s)
+                        a, kw = (), {}
+                return s, v
+            return action
+        return run
+
 def inc(ctx, v):
     return lambda s: (s+1,v)
 
+def _inc_cell(ctx, cell, v):
+    cell.s += 1
+    return v
+inc.cell_step = _inc_cell
+
 def put(n):
     def wrapped(ctx, v):
         return lambda s: (n, v)
+    def cell_step(ctx, cell, v):
+        cell.s = n
+        return v
+    wrapped.cell_step = cell_step
     return wrapped
 
 def get(ctx, v):
     return lambda s: (s, s)
 
+def _get_cell(ctx, cell, v):
+    return cell.s
+get.cell_step = _get_cell
+
+def _unique(xs, key=None):
+    """ xs without duplicates (by hash, keeping the first one). unhashable values are kept as is"""
+    seen = set()
+    for x in xs:
+        k = x if key is None else key(x)
+        try:
+            if k in seen:
+                continue
+            seen.add(k)
+        except TypeError:
+            pass
+        yield x
+
+def _top(xs, n, key=None):
+    """ the n largest values by key, in the original order"""
+    xs = list(xs)
+    if len(xs) <= n:
+        return xs
+    score = (lambda i: xs[i]) if key is None else (lambda i: key(xs[i]))
+    return [xs[i] for i in sorted(heapq.nlargest(n, range(len(xs)), key=score))]
+
+def _bind_iter(ctx, xs, f):
+    return (y for x in xs for y in f(ctx, x))
+
+def _map_iter(f, xs, extra):
+    if extra:
+        extra = [list(e) for e in extra]  # xs is consumed lazily (product reads all of its inputs first)
+        return (f(x, *es) for x in xs for es in itertools.product(*extra))
+    return (f(x) for x in xs)
+
 class ListF(Context):
+    """ list of possible values.
+
+    options bounding combinatorial search:
+      dedup: drop duplicated values of each step (True, or a function returning a hashable key of a value)
+      beam: keep only the top beam values of each step by key (a function, the value itself if not given)
+      limit: keep only the first limit results of the query. expansion stops once limit results are found
+        (values between steps are iterators then)
+    dedup and beam are applied per step as written, also to maps fused by ChainedQuery.optimize().
+    """
+    dedup = False
+    beam = None
+    key = None
+    limit = None
+    pruning = False
+
+    def __init__(self, dedup=False, beam=None, key=None, limit=None):
+        self.dedup = dedup
+        self.beam = beam
+        self.key = key
+        self.limit = limit
+        self.pruning = bool(dedup) or beam is not None or limit is not None
+        self.finishing = limit is not None
+
+    def prune_iter(self, xs):
+        """ xs (iterable) pruned by dedup and beam, as an iterator"""
+        if self.dedup:
+            xs = _unique(xs, None if self.dedup is True else self.dedup)
+        if self.beam is not None:
+            xs = iter(_top(xs, self.beam, self.key))
+        return xs
+
+    def prune(self, xs):
+        """ values of a step. a list, or a lazy iterator with limit (limited by finish)"""
+        xs = self.prune_iter(xs)
+        return xs if self.limit is not None else list(xs)
+
+    def finish(self, xs):
+        return list(itertools.islice(xs, self.limit))
+
+    def branches(self, xs, n):
+        if isinstance(xs, list):
+            return [xs] * n
+        return list(itertools.tee(xs, n))
+
     def unit(self, v):
         return [v]
 
     def bind(self, xs, f, *args, **kwargs):
+        if self.pruning:
+            return self.prune(_bind_iter(self, xs, f))
         r = []
         for x in xs:
             r.extend(f(self, x))
@@ -336,20 +1299,240 @@ class ListF(Context):
         return self.unit(f(v, *args, **kwargs))
 
     def map(self, f, vs, *args): #wa:
+        if self.pruning:
+            if isinstance(f, Composed) and not args:
+                for g in f.fs:
+                    vs = self.map(g, vs)
+                return vs
+            return self.prune(_map_iter(f, vs, args))
         if not args:
+            if isinstance(f, Composed):
+                return f.over(vs)
             return [f(v) for v in vs]
         return [f(*es) for es in itertools.product(vs, *args)]
 
+    @classmethod
+    def compile_steps(cls, steps):
+        ## composed maps are applied over the list at once (extra is None)
+        plan = tuple((MAP, f.over, None) if kind is MAP and isinstance(f, Composed) else (kind, f, extra)
+                     for kind, f, extra in lower_steps(steps))
+        ## pruned per map as written, so optimize() doesn't change the results
+        pruning_plan = lower_steps(steps, decompose=True)
+
+        def run(ctx, xs, *args, **kwargs):
+            if ctx.pruning:
+                return run_pruning(ctx, xs, args, kwargs)
+            for kind, f, extra in plan:
+                if kind is DO:
+                    xs = [y for x in xs for y in f(ctx, x)]
+                elif kind is MAP:
+                    if extra:
+                        xs = [f(*es) for es in itertools.product(xs, *extra)]
+                    elif extra is None:
+                        xs = f(xs)
+                    else:
+                        xs = [f(x) for x in xs]
+                elif kind is DIRECT:
+                    xs = f(ctx, xs, *args, **kwargs)
+                else:
+                    for g in f:
+                        xs = [y for x in xs for y in g(ctx, x)]
+                if args or kwargs:
+                    args, kwargs = (), {}
+            return xs
+
+        ## with limit, values are generated lazily, so expansion stops at the limit (see finish)
+        def run_pruning(ctx, xs, args, kwargs):
+            prune = ctx.prune
+            for kind, f, extra in pruning_plan:
+                if kind is DO:
+                    xs = prune(_bind_iter(ctx, xs, f))
+                elif kind is MAP:
+                    xs = prune(_map_iter(f, xs, extra))
+                elif kind is DIRECT:
+                    xs = f(ctx, xs, *args, **kwargs)
+                else:
+                    for g in f:
+                        xs = prune(_bind_iter(ctx, xs, g))
+                if args or kwargs:
+                    args, kwargs = (), {}
+            return xs
+        return run
+
+class LazyListF(ListF):
+    """ ListF computing lazily, depth first. results are iterators.
+    memory is proportional to the depth of search, not the breadth.
+    dedup and limit are applied lazily (beam needs all values of the step).
+    """
+    def finish(self, xs):
+        return itertools.islice(xs, self.limit)
+
+    def bind(self, xs, f, *args, **kwargs):
+        ys = (y for x in xs for y in f(self, x))
+        return self.prune_iter(ys) if self.pruning else ys
+
+    def map(self, f, vs, *args):
+        if self.pruning and isinstance(f, Composed) and not args:
+            for g in f.fs:
+                vs = self.map(g, vs)
+            return vs
+        if not args:
+            ys = (f(v) for v in vs)
+        else:
+            args = [list(xs) for xs in args]
+            ys = (f(v, *es) for v in vs for es in itertools.product(*args))
+        return self.prune_iter(ys) if self.pruning else ys
+
+    @classmethod
+    def compile_steps(cls, steps):
+        return super(ListF, cls).compile_steps(steps)
+
+    ## utility
+    def take(self, n, xs):
+        return list(itertools.islice(xs, n))
+
+    def first(self, xs, default=None):
+        return next(iter(xs), default)
+
+def _bind_chunk(arguments):
+    f, xs = arguments
+    return ListF().bind(xs, f)
+
+class ParallelListF(ListF):
+    """ ListF evaluating bind on a process pool.
+    the input list of each bind is split into chunks, and the results are merged in order.
+    executor is anything having map(fn, iterable) keeping order
+    (multiprocessing.Pool, concurrent.futures executors). if not given, multiprocessing.Pool is used.
+    f must be picklable (defined on module level), and it receives ListF() as ctx on the worker.
+    the pool created here is closed by close(), at the end of with block, or when the context is collected.
+
+      with ParallelListF(processes=4) as M:
+          q.value(M, xs)
+    """
+    _executor = None
+    _owned = False
+
+    def __init__(self, executor=None, processes=None, chunksize=1024, threshold=4096,
+                 dedup=False, beam=None, key=None, limit=None):
+        ListF.__init__(self, dedup=dedup, beam=beam, key=key, limit=limit)
+        self._executor = executor
+        self._owned = executor is None
+        self.processes = processes
+        self.chunksize = chunksize
+        self.threshold = threshold
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if self._owned and self._executor is not None:
+            self._executor.terminate()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            import multiprocessing
+            self._executor = multiprocessing.Pool(self.processes)
+        return self._executor
+
+    def close(self):
+        if self._owned and self._executor is not None:
+            self._executor.close()
+            self._executor.join()
+            self._executor = None
+
+    def bind(self, xs, f, *args, **kwargs):
+        xs = list(xs)
+        if len(xs) < self.threshold:
+            return ListF.bind(self, xs, f)
+        size = self.chunksize
+        chunks = [(f, xs[i:i + size]) for i in range(0, len(xs), size)]
+        r = []
+        for ys in self.executor.map(_bind_chunk, chunks):
+            r.extend(ys)
+        return self.prune(r) if self.pruning else r
+
+    @classmethod
+    def compile_steps(cls, steps):
+        return super(ListF, cls).compile_steps(steps)
+
+class Log(object):
+    """ outputs appended to a monoid by WriterF.bind. appending is O(1), and persistent
+    (branches share their prefix). build() concatenates them at once (by mconcat if the class has it).
+    """
+    __slots__ = ["tail", "m"]
+    def __init__(self, tail, m):
+        self.tail = tail
+        self.m = m
+
+    def build(self):
+        parts = []
+        node = self
+        while node.__class__ is Log:
+            parts.append(node.m)
+            node = node.tail
+        acc, result = accumulator(node)
+        for m in reversed(parts):
+            acc.append(m)
+        return result(acc)
+
 class WriterF(Context):
-    def __init__(self, monoid_class):
+    """ with sink (a callable, a file-like object, a queue or block.chain.sink.Sink),
+    tell outputs are sent to the sink in batches, and the monoid of (m, v) is a Window
+    of the last window outputs (all if None). the rest is flushed at the end of each run.
+    """
+    sink = None
+
+    def __init__(self, monoid_class, sink=None, batch=100, window=DEFAULT_WINDOW):
         self.monoid = monoid_class
+        if sink is not None and not isinstance(sink, Sink):
+            sink = Sink(sink, batch)
+        self.sink = sink
+        self.window = window
+        self.identity = monoid_class.empty().value
+
+    ## tell outputs of copy-on-append monoids are carried as a Log between steps of value(),
+    ## and the monoid is built at once for direct steps and at the end of the run
+    finishing = settling = True
+
+    def settle(self, (m, v)):
+        if m.__class__ is Log:
+            return (m.build(), v)
+        return (m, v)
+
+    def finish(self, mv):
+        if self.sink is not None:
+            self.sink.flush()
+        return self.settle(mv)
 
     def unit(self, v):
         return (self.monoid.empty(), v)
 
     def bind(self, (m0,v0), f, *args, **kwargs):
         m1, v = f(self, v0, *args, **kwargs)
-        return (m0.append(m1),v)
+        if self.sink is not None:
+            return (self.told(self.windowed(m0), m1), v)
+        if m0.__class__ is Log or m0.__class__.__module__ != MFailure.__module__:
+            return (Log(m0, m1), v)
+        return (m0.append(m1),v)  # mutable monoids
+
+    def windowed(self, m):
+        if isinstance(m, Window):
+            return m
+        return Window(self.monoid, () if m.value == self.identity else (m, ), self.window)
+
+    def told(self, window, m):
+        """ sending m to the sink, and appending it to the window"""
+        self.sink.emit(m.value)
+        window.append(m)
+        return window
+
+    def flush(self):
+        if self.sink is not None:
+            self.sink.flush()
         
     def lifted(self, f, v, *args, **kwargs):
         return self.unit(f(v, *args, **kwargs))
@@ -357,6 +1540,61 @@ class WriterF(Context):
     def map(self, f, (m,v), *args, **kwargs):
         return (m, f(v, *args, **kwargs))
 
+    def fork(self, (m, v)):
+        if isinstance(m, Window):
+            return (m.copy(), v)
+        if m.__class__.__module__ == MFailure.__module__:  # mutable monoids
+            return (m.empty().append(m), v)
+        return (m, v)
+
+    @classmethod
+    def compile_steps(cls, steps):
+        plan = lower_steps(steps)
+
+        def run_sink(ctx, init, args, kwargs):
+            m, v = init
+            window, told = ctx.windowed(m), ctx.told
+            for kind, f, extra in plan:
+                if kind is DO:
+                    m1, v = f(ctx, v, *args, **kwargs)
+                    told(window, m1)
+                elif kind is MAP:
+                    v = f(v, *extra)
+                elif kind is DIRECT:
+                    m, v = f(ctx, (window, v), *args, **kwargs)
+                    window = ctx.windowed(m)
+                else:
+                    for g in f:
+                        m1, v = g(ctx, v, *args, **kwargs)
+                        told(window, m1)
+                if args or kwargs:
+                    args, kwargs = (), {}
+            return (window, v)
+
+        ## tell outputs are collected into one accumulator, and the monoid value is built at the end
+        def run(ctx, init, *args, **kwargs):
+            if ctx.sink is not None:
+                return run_sink(ctx, init, args, kwargs)
+            m, v = init
+            acc, result = accumulator(m)
+            for kind, f, extra in plan:
+                if kind is DO:
+                    m1, v = f(ctx, v, *args, **kwargs)
+                    acc.append(m1)
+                elif kind is MAP:
+                    v = f(v, *extra)
+                elif kind is DIRECT:
+                    m, v = f(ctx, (result(acc), v), *args, **kwargs)
+                    acc, result = accumulator(m)
+                else:
+                    for g in f:
+                        m1, v = g(ctx, v, *args, **kwargs)
+                        acc.append(m1)
+                if args or kwargs:
+                    args, kwargs = (), {}
+            return (result(acc), v)
+        return run
+
     ## utility
     def tell(self, w):
         return lambda ctx, v: (ctx.monoid(value=w), v)
@@ -0,0 +1,340 @@
+# -*- coding:utf-8 -*-
+"""
+batch execution, running one ChainedQuery over many inputs at once.
+
+  q.value_many(MaybeF(), [1, 2, Nothing]) # => Batch
+
+with MaybeF/ErrorF, failures are carried as a mask. map steps with a vectorized function
+(numpy ufunc or marked by `vectorized`) are applied to the whole array,
+and the other steps are executed per element.
+
+columnar extraction of paths, as MaybeF (misses are marked on the mask, without exceptions).
+
+  cols = extract({"name": chain.user.name, "age": chain["age"]}, records)
+  cols["age"].values, cols["age"].mask  # ndarray (or array.array) and its validity
+"""
+import array
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from block.chain import (
+    Any,
+    MaybeF,
+    ErrorF,
+    MAP,
+    DIRECT,
+    Nothing,
+    VirtualObject,
+    ATTR,
+    ITEM,
+    CALL,
+    )
+
+def vectorized(f=None, dtype=None):
+    """ mark f as applicable to a whole array at once (such as lambda xs: xs * 2 + 1).
+    values of one type (bool, int or float) are passed as an ndarray of bool, int64 or float64,
+    so f computes with int64 semantics (overflow wraps around, as numpy).
+    dtype=object passes the values as they are (exact for big ints), as @vectorized(dtype=object).
+    """
+    if f is None:
+        return lambda f: vectorized(f, dtype)
+    f.vectorized = True
+    f.vectorized_dtype = dtype
+    return f
+
+def is_vectorized(f):
+    if np is not None and isinstance(f, np.ufunc):
+        return True
+    return getattr(f, "vectorized", False) is True
+
+
+class Batch(object):
+    """ results of value_many.
+
+    mask[i] is True iff the i-th computation is not failed.
+    valid is the results of not failed computations
+    (ndarray iff they are produced by a vectorized step, otherwise a list of the values as they are).
+    failures is {i: failure-value}, kept only when the flavor has failure reasons (ErrorF).
+    """
+    def __init__(self, ctx, mask, valid, failures=None):
+        self.ctx = ctx
+        self.mask = mask
+        self.valid = valid
+        self.failures = failures or {}
+
+    def __len__(self):
+        return len(self.mask)
+
+    def __iter__(self):
+        valid = iter(self.valid)
+        for i, ok in enumerate(self.mask):
+            if ok:
+                yield next(valid)
+            else:
+                failure = self.failures.get(i)
+                yield self.ctx.failure(None) if failure is None else failure
+
+    def tolist(self):
+        return list(self)
+
+    @property
+    def values(self):
+        """ results with the same length as inputs. failed slots are filled with zero (or None)"""
+        if np is not None and isinstance(self.valid, np.ndarray):
+            r = np.zeros(len(self.mask), dtype=self.valid.dtype)
+            r[np.asarray(self.mask, dtype=bool)] = self.valid
+            return r
+        valid = iter(self.valid)
+        return [next(valid) if ok else None for ok in self.mask]
+
+
+_INT64 = 2 ** 63
+
+def _as_array(vs, dtype=None):
+    """ ndarray of vs, or None if some value would change by the conversion
+    (mixed types, ints out of int64). with dtype=object, values are kept as they are
+    """
+    if np is None:
+        return None
+    if isinstance(vs, np.ndarray):
+        return vs if dtype is None else vs.astype(dtype)
+    if not vs:
+        return None
+    if dtype is object:
+        arr = np.empty(len(vs), dtype=object)
+        arr[:] = vs
+        return arr
+    t = vs[0].__class__
+    if t not in (bool, int, float) or any(v.__class__ is not t for v in vs):
+        return None
+    if t is int and any(not -_INT64 <= v < _INT64 for v in vs):
+        return None
+    return np.asarray(vs)
+
+def _apply_vectorized(f, vs):
+    arr = _as_array(vs, getattr(f, "vectorized_dtype", None))
+    if arr is not None:
+        r = f(arr)
+        if isinstance(r, np.ndarray) and r.shape == arr.shape:
+            return r
+    if np is not None and isinstance(vs, np.ndarray):
+        vs = vs.tolist()
+    return [f(v) for v in vs]
+
+def _resolve(ctx, v):
+    if isinstance(v, Any):
+        return v.choice(ctx)
+    return v
+
+def value_many(query, ctx, inits):
+    steps = query.fs.items()
+    if not isinstance(ctx, MaybeF) or any(s.kind is DIRECT for s in steps):
+        results = [query.value(ctx, v) for v in inits]
+        return Batch(ctx, [True] * len(results), results)
+
+    failure_types = ctx.failure_types
+    keep_reasons = isinstance(ctx, ErrorF)
+    mask = []
+    valid = []
+    failures = {}
+    for i, v in enumerate(inits):
+        v = _resolve(ctx, v)
+        if isinstance(v, failure_types):
+            mask.append(False)
+            if keep_reasons:
+                failures[i] = v
+        else:
+            mask.append(True)
+            valid.append(v)
+
+    for step in steps:
+        if step.kind is MAP and not step.args and is_vectorized(step.f):
+            valid = _apply_vectorized(step.f, valid)
+            continue
+
+        if step.kind is MAP and step.args and keep_reasons:
+            ## failures are accumulated with the failures of arguments
+            for i in failures:
+                failures[i] = ctx.map(step.f, failures[i], *step.args)
+
+        if np is not None and isinstance(valid, np.ndarray):
+            valid = valid.tolist()
+        indices = [i for i, ok in enumerate(mask) if ok]
+        next_valid = []
+        for i, v in zip(indices, valid):
+            v = _resolve(ctx, step(ctx, v))
+            if isinstance(v, failure_types):
+                mask[i] = False
+                if keep_reasons:
+                    failures[i] = v
+            else:
+                next_valid.append(v)
+        valid = next_valid
+
+    if np is not None:
+        mask = np.asarray(mask, dtype=bool)
+    return Batch(ctx, mask, valid, failures)
+
+
+### columnar extraction
+_MISSING = object()
+
+def _safe_getter(entry):
+    """ a function of a path entry, returning _MISSING instead of raising"""
+    kind, k = entry[0], entry[1]
+    if kind is ATTR:
+        def get(o):
+            try:
+                return getattr(o, k, _MISSING)
+            except Exception:
+                return _MISSING
+    elif kind is ITEM:
+        def get(o):
+            if o.__class__ is dict:
+                return o.get(k, _MISSING)
+            try:
+                return o[k]
+            except Exception:
+                return _MISSING
+    elif kind is CALL:
+        args, kwargs = entry[2], dict(entry[3])
+        def get(o):
+            try:
+                return getattr(o, k)(*args, **kwargs)
+            except Exception:
+                return _MISSING
+    else:
+        get = lambda _: k
+    return get
+
+def safe_path(path):
+    """ function getting the value of path (of VirtualObject), or _MISSING"""
+    getters = tuple(_safe_getter(e) for e in path)
+    if len(getters) == 1:
+        return getters[0]
+    def get(o):
+        for g in getters:
+            o = g(o)
+            if o is _MISSING:
+                return o
+        return o
+    return get
+
+class Column(object):
+    """ values of a path. values[i] is meaningful iff mask[i] (missing slots are filled with 0 or None)"""
+    __slots__ = ["name", "values", "mask"]
+    def __init__(self, name, values, mask):
+        self.name = name
+        self.values = values
+        self.mask = mask
+
+    def __len__(self):
+        return len(self.mask)
+
+    def __iter__(self):
+        for v, ok in zip(self.values, self.mask):
+            yield v if ok else Nothing
+
+    def tolist(self):
+        return list(self)
+
+class Columns(object):
+    """ struct of arrays. columns are accessed by name (in the order of paths)"""
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, name):
+        for column in self.columns:
+            if column.name == name:
+                return column
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def names(self):
+        return [column.name for column in self.columns]
+
+_EXACT_FLOAT = 2 ** 53
+
+def _typecode(values, mask):
+    """ typecode of array.array for values ("b", "l", "d"), or None.
+    ints mixed with floats are "d" only if they are exact as float (|v| <= 2**53)
+    """
+    code = None
+    inexact = False  # some int is not exact as float
+    for v, ok in zip(values, mask):
+        if not ok:
+            continue
+        cls = v.__class__
+        if cls is bool:
+            c = "b"
+        elif cls is int:
+            c = "l"
+            if not inexact and not -_EXACT_FLOAT <= v <= _EXACT_FLOAT:
+                inexact = True
+        elif cls is float:
+            c = "d"
+        else:
+            return None
+        if code is None or code == c:
+            code = c
+        elif {code, c} == {"l", "d"}:
+            code = "d"
+        else:
+            return None
+    if code == "d" and inexact:
+        return None
+    return code
+
+def _column(name, values, mask):
+    code = _typecode(values, mask)
+    if code is not None:
+        zero = {"b": False, "l": 0, "d": 0.0}[code]
+        filled = [v if ok else zero for v, ok in zip(values, mask)]
+        if np is not None:
+            dtype = {"b": bool, "l": np.int64, "d": np.float64}[code]
+            return Column(name, np.array(filled, dtype=dtype), np.array(mask, dtype=bool))
+        return Column(name, array.array(code, filled), array.array("b", mask))
+    if np is not None:
+        return Column(name, values, np.array(mask, dtype=bool))
+    return Column(name, values, array.array("b", mask))
+
+def _path_name(vo):
+    return ".".join(str(name) for name in vo.names)
+
+def extract(paths, records):
+    """ Columns of paths (VirtualObject, such as chain.x.y or chain["a"]["b"]) over records.
+    same as chain.chain.do(path).value(MaybeF(), record) for each record,
+    but misses (and Nothing) are marked on the mask, and no exception is raised for them.
+    paths are a list (named by their path) or a dict of {name: path}.
+    """
+    if isinstance(paths, dict):
+        named = sorted(paths.items())
+    else:
+        named = [(_path_name(vo), vo) for vo in paths]
+    for name, vo in named:
+        if not isinstance(vo, VirtualObject):
+            raise TypeError("{0!r} is not a path".format(vo))
+    getters = [safe_path(vo._path) for name, vo in named]
+
+    n = len(getters)
+    values = [[] for i in range(n)]
+    masks = [[] for i in range(n)]
+    columns = list(zip(getters, values, masks))
+    for record in records:
+        for get, vs, mask in columns:
+            v = get(record)
+            if v is _MISSING or v is Nothing:
+                vs.append(None)
+                mask.append(False)
+            else:
+                vs.append(v)
+                mask.append(True)
+    return Columns([_column(name, vs, mask) for (name, vo), vs, mask in zip(named, values, masks)])
@@ -0,0 +1,111 @@
+# -*- coding:utf-8 -*-
+"""
+microbenchmarks. each module has run(quick=False) returning rows (dict), and main().
+
+  python -m block.chain.benchmarks                      # all
+  python -m block.chain.benchmarks state monoid --json out.json
+  python -m block.chain.benchmarks --compare out.json   # ratio to the previous run
+"""
+import os
+import sys
+import timeit
+import pickle
+
+MODULES = ["flavors", "state", "monoid", "vobject", "imports"]
+
+def measure(fn, number=None, repeat=3, min_time=0.2):
+    """ best seconds per call of fn. number is decided automatically if not given"""
+    timer = timeit.Timer(fn)
+    if number is None:
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 2
+    return min(timer.repeat(repeat, number)) / number
+
+def bench(name, fn, steps=None, quick=False, memory=True, **extra):
+    """ a row of results. ns_per_op is per call of fn, ns_per_step is ns_per_op / steps"""
+    seconds = measure(fn, repeat=2 if quick else 3, min_time=0.02 if quick else 0.2)
+    row = {"name": name, "ns_per_op": int(seconds * 1e9)}
+    if steps:
+        row["ns_per_step"] = int(seconds / steps * 1e9)
+    if memory:
+        row["peak_kb"] = peak_memory(fn)
+    row.update(extra)
+    return row
+
+def stack_depth():
+    frame = sys._getframe(1)
+    n = 0
+    while frame is not None:
+        n += 1
+        frame = frame.f_back
+    return n
+
+def _peak_rss(reset=False):
+    """ peak RSS (KB). on linux the peak is reset by /proc/self/clear_refs (reset=True),
+    otherwise it is the max RSS of the process, inherited from the parent (increases below it are hidden)
+    """
+    try:
+        if reset:
+            with open("/proc/self/clear_refs", "w") as wf:
+                wf.write("5")
+        with open("/proc/self/status") as rf:
+            for line in rf:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+_baseline = []
+
+def peak_memory(fn):
+    """ increase of peak RSS (KB) while running fn, measured in a forked child. None if fork is not available.
+    the increase of running nothing (pages touched by the measurement itself) is subtracted.
+    """
+    if not hasattr(os, "fork"):
+        return None
+    if not _baseline:
+        _baseline.append(_peak_memory(lambda: None) or 0)
+    kb = _peak_memory(fn)
+    return None if kb is None else max(kb - _baseline[0], 0)
+
+def _peak_memory(fn):
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            os.close(r)
+            before = _peak_rss(reset=True)
+            fn()
+            after = _peak_rss()
+            os.write(w, pickle.dumps(after - before))
+        finally:
+            os._exit(0)
+    os.close(w)
+    with os.fdopen(r, "rb") as rf:
+        data = rf.read()
+    os.waitpid(pid, 0)
+    return pickle.loads(data) if data else None
+
+def load(name):
+    return __import__("{0}.{1}".format(__name__, name), fromlist=["run"])
+
+def run_modules(names=None, quick=False):
+    rows = []
+    for name in names or MODULES:
+        for row in load(name).run(quick=quick):
+            row["name"] = "{0}:{1}".format(name, row["name"])
+            rows.append(row)
+    return rows
+
+def report(rows, out=sys.stdout, baseline=None):
+    """ baseline is {name: row} of a previous run, showing the ratio of ns_per_op"""
+    width = max([len(row["name"]) for row in rows] or [0]) + 2
+    for row in rows:
+        value = ", ".join("{0}={1}".format(k, v) for k, v in sorted(row.items()) if k != "name")
+        previous = (baseline or {}).get(row["name"])
+        if previous and previous.get("ns_per_op"):
+            value += ", ratio={0:.2f}".format(float(row["ns_per_op"]) / previous["ns_per_op"])
+        out.write("{0}{1}\n".format(row["name"].ljust(width), value))
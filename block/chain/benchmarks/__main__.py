@@ -0,0 +1,35 @@
+# -*- coding:utf-8 -*-
+import sys
+import json
+import platform
+import argparse
+from block.chain.benchmarks import MODULES, run_modules, report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m block.chain.benchmarks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help="benchmark modules ({0}). all if not given".format(", ".join(MODULES)))
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and shorter timing")
+    parser.add_argument("--json", metavar="PATH", help="write results as json")
+    parser.add_argument("--compare", metavar="PATH", help="json of a previous run, to show ratios")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in MODULES]
+    if unknown:
+        parser.error("unknown benchmark: {0}".format(", ".join(unknown)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as rf:
+            baseline = dict((row["name"], row) for row in json.load(rf)["results"])
+
+    rows = run_modules(args.names, quick=args.quick)
+    report(rows, baseline=baseline)
+    if args.json:
+        with open(args.json, "w") as wf:
+            json.dump({"python": platform.python_version(),
+                       "implementation": platform.python_implementation(),
+                       "argv": sys.argv[1:],
+                       "results": rows}, wf, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
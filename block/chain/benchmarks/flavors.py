@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+"""
+chains on each flavor: MaybeF/ErrorF by length (with and without failure), ListF by fan-out depth,
+WriterF by length. both value() and compile(ctx) are measured.
+"""
+from block.chain import chain, MaybeF, ErrorF, ListF, LazyListF, WriterF
+from block.chain.monoid import immutable, mutable
+from block.chain.benchmarks import bench, report
+
+def inc(ctx, v):
+    return v + 1
+
+def stop(ctx, v):
+    return ctx.failure(v)
+
+def branch(ctx, v):
+    return [v, v + 1]
+
+def both(name, q, ctx, init, steps, quick, **extra):
+    compiled = q.compile(ctx)
+    return [bench(name, lambda: q.value(ctx, init), steps=steps, quick=quick, **extra),
+            bench(name + "/compiled", lambda: compiled(init), steps=steps, quick=quick, **extra)]
+
+def run(quick=False):
+    rows = []
+    lengths = (10, 100) if quick else (10, 100, 1000)
+    for ctx in (MaybeF(), ErrorF()):
+        name = ctx.__class__.__name__
+        for n in lengths:
+            q = chain.chain.do(*[inc] * n)
+            rows.extend(both("{0}/steps={1}".format(name, n), q, ctx, 0, n, quick))
+            q = chain.chain.do(stop).do(*[inc] * (n - 1))
+            rows.extend(both("{0}/steps={1}/failed".format(name, n), q, ctx, 0, n, quick))
+
+    for ctx in (ListF(), LazyListF()):
+        name = ctx.__class__.__name__
+        for depth in (4, 8) if quick else (4, 8, 12):
+            q = chain.chain.do(*[branch] * depth)
+            rows.extend(both("{0}/depth={1}".format(name, depth), q, ctx, [0], 2 ** depth, quick,
+                             results=2 ** depth))
+
+    for module in (immutable, mutable):
+        ctx = WriterF(module.ListMonoid)
+        for n in lengths:
+            q = chain.chain.do(*[ctx.tell(["x"])] * n)
+            rows.extend(both("WriterF/{0}/steps={1}".format(module.__name__.rsplit(".", 1)[-1], n),
+                             q, ctx, ctx.unit(0), n, quick))
+    return rows
+
+def main():
+    report(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+"""
+import time of block.chain, measured in fresh interpreters (interpreter startup is not included).
+zope.interface and pkg_resources are measured for reference, they are not imported by block.chain.
+"""
+import os
+import sys
+import subprocess
+import block
+from block.chain.benchmarks import report
+
+SCRIPT = """
+import sys, time
+t = time.time()
+{0}
+sys.stdout.write(repr(time.time() - t))
+"""
+
+CASES = [
+    ("block.chain", "import block.chain"),
+    ("block.chain+interfaces", "import block.chain.interfaces"),
+    ("block.chain.batch", "import block.chain.batch"),
+    ("zope.interface", "import zope.interface"),
+    ("pkg_resources", "import pkg_resources"),
+]
+
+def root():
+    return os.path.dirname(os.path.dirname(os.path.abspath(block.__file__)))
+
+def import_time(statement):
+    """ seconds of statement in a fresh interpreter. None if it fails (e.g. not installed)"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([root()] + [p for p in [env.get("PYTHONPATH")] if p])
+    p = subprocess.Popen([sys.executable, "-c", SCRIPT.format(statement)], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, _ = p.communicate()
+    if p.returncode != 0:
+        return None
+    return float(out)
+
+def run(quick=False):
+    rows = []
+    for name, statement in CASES:
+        times = [import_time(statement) for i in range(3 if quick else 10)]
+        if None in times:
+            continue
+        rows.append({"name": name, "ns_per_op": int(min(times) * 1e9)})
+    return rows
+
+def main():
+    report(run())
+
+if __name__ == "__main__":
+    main()
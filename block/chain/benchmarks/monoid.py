@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+"""
+monoid appends. StringMonoid and Failure are compared with the former list based classes,
+and mutable with immutable monoids. mconcat is compared with appending one by one.
+"""
+from block.chain.monoid import immutable, mutable
+from block.chain.benchmarks import bench, report
+
+class ListStringMonoid(object):
+    """ the former immutable StringMonoid, for comparison"""
+    def __init__(self, value):
+        self._value = value if isinstance(value, list) else [value]
+
+    def append(self, other):
+        value = self._value[:]
+        value.extend(other._value)
+        return self.__class__(value)
+
+    @property
+    def value(self):
+        return u"".join(self._value)
+
+class ListFailure(object):
+    """ the former immutable Failure, for comparison"""
+    def __init__(self, value=None, values=None):
+        self.values = values or [value]
+
+    def append(self, other):
+        vs = self.values[:]
+        vs.extend(other.values)
+        return self.__class__(values=vs)
+
+    @property
+    def value(self):
+        return u"".join([unicode(v) for v in self.values])
+
+def appending(cls, n, read_every):
+    def run():
+        m = cls("x")
+        for i in range(n):
+            m = m.append(cls("y"))
+            if i % read_every == 0:
+                m.value
+        return m.value
+    return run
+
+def keeping(cls, n):
+    """ appending while keeping every intermediate value (as branches of a search do)"""
+    def run():
+        ms = [cls("x")]
+        for i in range(n):
+            ms.append(ms[-1].append(cls("y")))
+        return ms
+    return run
+
+def appending_same(cls, n):
+    def run():
+        m = cls.empty()
+        for i in range(n):
+            m = m.append(cls([i]) if issubclass(cls, (immutable.ListMonoid, mutable.ListMonoid)) else cls(i))
+        return m
+    return run
+
+def concatenating(cls, n):
+    def run():
+        return cls.mconcat(cls([i]) if issubclass(cls, (immutable.ListMonoid, mutable.ListMonoid)) else cls(i)
+                           for i in range(n))
+    return run
+
+def run(quick=False):
+    n = 500 if quick else 2000
+    rows = []
+    candidates = [("list/StringMonoid", ListStringMonoid),
+                  ("immutable/StringMonoid", immutable.StringMonoid),
+                  ("mutable/StringMonoid", mutable.StringMonoid),
+                  ("list/Failure", ListFailure),
+                  ("immutable/Failure", immutable.Failure),
+                  ("mutable/Failure", mutable.Failure)]
+    for every in (10, n):
+        for name, cls in candidates:
+            rows.append(bench("{0}/appends={1}/read_every={2}".format(name, n, every),
+                              appending(cls, n, every), steps=n, quick=quick))
+    ## alternating appends and reads. ns_per_step stays flat over sizes if reading is incremental
+    for size in (n, n * 4):
+        for name, cls in candidates[3:]:
+            rows.append(bench("{0}/appends={1}/read_every=1".format(name, size),
+                              appending(cls, size, 1), steps=size, quick=quick))
+    for name, cls in candidates[:5]:
+        rows.append(bench("{0}/appends={1}/keep_all".format(name, n), keeping(cls, n), steps=n, quick=quick))
+
+    for module in (immutable, mutable):
+        for cls in (module.SumMonoid, module.ListMonoid):
+            rows.append(bench("{0}/{1}/appends={2}".format(module.__name__.rsplit(".", 1)[-1], cls.__name__, n),
+                              appending_same(cls, n), steps=n, quick=quick))
+            rows.append(bench("{0}/{1}/mconcat={2}".format(module.__name__.rsplit(".", 1)[-1], cls.__name__, n),
+                              concatenating(cls, n), steps=n, quick=quick))
+    return rows
+
+def main():
+    report(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# -*- coding:utf-8 -*-
+"""
+StateF chains: per step cost and stack depth, compared with nested closures (the former StateF.bind).
+StateF(cell=True) keeps the state in a mutable cell
+"""
+from block.chain import chain, StateF, inc
+from block.chain.benchmarks import bench, stack_depth, report
+
+class NestedStateF(StateF):
+    """ StateF.bind as nested closures, for comparison"""
+    def bind(self, ma, f, *args, **kwargs):
+        def wrapped(s):
+            s1, v = ma(s)
+            fk = f(self, v, *args, **kwargs)
+            return fk(s1)
+        return wrapped
+
+def probe(depths):
+    def step(ctx, v):
+        def action(s):
+            depths.append(stack_depth())
+            return s, v
+        return action
+    return step
+
+def run(quick=False):
+    rows = []
+    for name, ctx in [("NestedStateF", NestedStateF()), ("StateF", StateF()), ("StateF(cell=True)", StateF(cell=True))]:
+        for n in (10, 100) if quick else (10, 100, 500):
+            q = chain.chain.do(*[inc] * n)
+            action = q.value(ctx, ctx.unit(0))
+
+            depths = []
+            chain.chain.do(probe(depths)).do(*[inc] * n).value(ctx, ctx.unit(0))(0)
+            rows.append(bench("{0}/steps={1}".format(name, n),
+                              lambda: action(0), steps=n, quick=quick, stack_depth=depths[0]))
+
+            compiled = q.compile(ctx)(ctx.unit(0))
+            rows.append(bench("{0}/steps={1}/compiled".format(name, n),
+                              lambda: compiled(0), steps=n, quick=quick))
+    return rows
+
+def main():
+    report(run())
+
+if __name__ == "__main__":
+    main()
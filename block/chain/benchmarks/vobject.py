@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+"""
+VirtualObject path lookups: value() of a shared path, and do(chain.x.y.z) on MaybeF.
+columnar extraction (block.chain.batch.extract) of paths over records, compared with value() per record
+"""
+from block.chain import chain, VirtualObject, MaybeF
+from block.chain.batch import extract
+from block.chain.benchmarks import bench, report
+
+class Node(object):
+    def __init__(self, child=None):
+        self.child = child
+
+def nested(depth):
+    o = Node(1)
+    for i in range(depth - 1):
+        o = Node(o)
+    return o
+
+def run(quick=False):
+    rows = []
+    for depth in (1, 3, 8):
+        o = nested(depth)
+        path = VirtualObject()
+        for i in range(depth):
+            path = path.child
+        rows.append(bench("attr/depth={0}".format(depth), lambda: path.value(o), steps=depth, quick=quick))
+
+        d = 1
+        for i in range(depth):
+            d = {"child": d}
+        path = VirtualObject()
+        for i in range(depth):
+            path = path["child"]
+        rows.append(bench("item/depth={0}".format(depth), lambda: path.value(d), steps=depth, quick=quick))
+
+        ctx = MaybeF()
+        wrapped = chain
+        for i in range(depth):
+            wrapped = wrapped["child"]
+        q = chain.chain.do(wrapped)
+        rows.append(bench("MaybeF/item/depth={0}".format(depth), lambda: q.value(ctx, d), steps=depth, quick=quick))
+        rows.append(bench("MaybeF/item/depth={0}/missing".format(depth), lambda: q.value(ctx, {}),
+                          steps=depth, quick=quick))
+
+    ## a third of records miss the path
+    n = 1000 if quick else 10000
+    records = [{"a": {"b": i}, "c": i * 0.5} if i % 3 else {"c": None} for i in range(n)]
+    paths = [chain["a"]["b"], chain["c"]]
+    queries = [chain.chain.do(path) for path in paths]
+    ctx = MaybeF()
+    rows.append(bench("extract/records={0}/value".format(n),
+                      lambda: [[q.value(ctx, r) for r in records] for q in queries],
+                      steps=n, quick=quick, memory=False))
+    rows.append(bench("extract/records={0}/columns".format(n), lambda: extract(paths, records),
+                      steps=n, quick=quick, memory=False))
+    return rows
+
+def main():
+    report(run())
+
+if __name__ == "__main__":
+    main()
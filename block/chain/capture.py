@@ -0,0 +1,85 @@
+# -*- coding:utf-8 -*-
+"""
+capture policy of ErrorF.
+
+  ErrorF(policy=CapturePolicy(limit=100))
+
+compact: exceptions are kept as FailureRecord (type name, message, location),
+  without keeping the exception object (and its traceback and frames) alive.
+  the same records are interned.
+limit: the number of values accumulated in a Failure (by ctx.failure, choice_another and map).
+  the rest are counted on Failure.dropped. failures passing through are kept as they are.
+fail_fast: map returns the first failure, without accumulating the others.
+"""
+import sys
+import threading
+
+class FailureRecord(object):
+    __slots__ = ["type", "message", "location"]
+    def __init__(self, type, message, location=None):
+        self.type = type
+        self.message = message
+        self.location = location
+
+    def __unicode__(self):
+        return self.message
+    __str__ = __unicode__
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and
+                (self.type, self.message, self.location) == (other.type, other.message, other.location))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.type, self.message, self.location))
+
+    def __repr__(self):
+        if self.location is None:
+            return "{0}({1!r})".format(self.type, self.message)
+        return "{0}({1!r}) at {2}:{3} in {4}".format(self.type, self.message, *self.location)
+
+def _location(e):
+    """ (filename, lineno, function) where e is raised, iff e is the exception being handled"""
+    exc_type, exc, tb = sys.exc_info()
+    if exc is not e or tb is None:
+        return None
+    try:
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        code = tb.tb_frame.f_code
+        return (code.co_filename, tb.tb_lineno, code.co_name)
+    finally:
+        del exc_type, exc, tb
+
+class CapturePolicy(object):
+    def __init__(self, compact=True, limit=None, fail_fast=False, intern_size=1024):
+        self.compact = compact
+        self.limit = limit
+        self.fail_fast = fail_fast
+        self.intern_size = intern_size
+        self.interned = {}
+        self.lock = threading.Lock()
+
+    def capture(self, v):
+        """ the value kept in Failure"""
+        if not (self.compact and isinstance(v, BaseException)):
+            return v
+        try:
+            message = unicode(v)
+        except Exception:
+            message = repr(v)
+        record = FailureRecord(v.__class__.__name__, message, _location(v))
+        interned = self.interned.get(record)
+        if interned is not None:
+            return interned
+        with self.lock:
+            if len(self.interned) < self.intern_size:
+                record = self.interned.setdefault(record, record)
+        return record
+
+    def truncated(self, failure):
+        if self.limit is None:
+            return failure
+        return failure.truncate(self.limit)
@@ -0,0 +1,51 @@
+# -*- coding:utf-8 -*-
+"""
+lazy interface declarations.
+
+  @implementer("IQuery")
+  class ChainedQuery(object): ...
+
+interfaces are referred by name (in block.chain.interfaces). the declarations are registered
+when block.chain.interfaces is imported, or at once if zope.interface is already imported,
+so importing block.chain doesn't import zope.interface (and zope.interface is not required).
+"""
+import sys
+import threading
+
+IMPLEMENTS = "implements"
+PROVIDES = "provides"
+
+INTERFACES = "block.chain.interfaces"
+
+_pending = []
+_lock = threading.Lock()
+
+def _declare(kind, target, names):
+    with _lock:
+        _pending.append((kind, target, names))
+    if INTERFACES in sys.modules or "zope.interface" in sys.modules:
+        __import__(INTERFACES)
+        flush()
+    return target
+
+def implementer(*names):
+    """ such as zope.interface.implementer, with interface names"""
+    return lambda cls: _declare(IMPLEMENTS, cls, names)
+
+def provider(*names):
+    """ such as zope.interface.provider (also for modules), with interface names"""
+    return lambda ob: _declare(PROVIDES, ob, names)
+
+def flush():
+    """ register the pending declarations. called at the end of block.chain.interfaces"""
+    from zope.interface import classImplements, alsoProvides
+    interfaces = sys.modules[INTERFACES]
+    with _lock:
+        pending = _pending[:]
+        del _pending[:]
+    for kind, target, names in pending:
+        ifaces = [getattr(interfaces, name) for name in names]
+        if kind is IMPLEMENTS:
+            classImplements(target, *ifaces)
+        else:
+            alsoProvides(target, *ifaces)
@@ -55,3 +55,6 @@ class IVirtualAccess(Interface):
 
     def methodcaller(method, *args, **kwargs):
         """ such as, self.method(*args, **kwargs)"""
+
+from block.chain.declarations import flush
+flush()
@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+"""
+memoization of do steps.
+
+  step = chain.memoize(f, maxsize=1024, ttl=60)
+  chain.chain.do(step)
+  chain.chain.do(f, memo={"maxsize": 1024})  # same
+  step.stats()  # => {"hits": .., "misses": .., ...}
+
+results are cached per flavor class, by (v, args, kwargs) and their types (1, 1.0 and True are not shared).
+unhashable inputs are not cached. expired results are dropped on calls.
+failures (Nothing/Failure) are cached only if cache_failures=True.
+results are stored and returned as branches of the flavor (ctx.branches), so mutable failures
+and iterators (LazyListF, ListF(limit=..)) are not shared with the caller.
+"""
+import time
+import threading
+from collections import OrderedDict, deque
+from block.chain import typed_key
+
+class Memoized(object):
+    def __init__(self, f, maxsize=128, ttl=None, cache_failures=False, timer=time.time):
+        self.f = f
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache_failures = cache_failures
+        self.timer = timer
+        self.__name__ = getattr(f, "__name__", f.__class__.__name__)
+        self.cache = OrderedDict()
+        self.expiring = deque()  # (expires, key) in the order of insertion
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.uncached = 0
+
+    def __call__(self, ctx, v, *args, **kwargs):
+        key = (ctx.__class__, typed_key((v, args, tuple(sorted(kwargs.items())) if kwargs else ())))
+        try:
+            hash(key)
+        except TypeError:
+            self.uncached += 1
+            return self.f(ctx, v, *args, **kwargs)
+
+        with self.lock:
+            if self.expiring:
+                self._expire(self.timer())
+            entry = self.cache.pop(key, None)
+            if entry is not None:
+                expires, result = entry
+                if expires is None or expires > self.timer():
+                    cached, result = ctx.branches(result, 2)
+                    self.cache[key] = (expires, cached)  # most recently used
+                    self.hits += 1
+                    return result
+                self.expirations += 1
+            self.misses += 1
+
+        result = self.f(ctx, v, *args, **kwargs)
+        failure_types = getattr(ctx, "failure_types", None)
+        if not self.cache_failures and failure_types is not None and isinstance(result, failure_types):
+            return result
+
+        cached, result = ctx.branches(result, 2)
+        expires = None if self.ttl is None else self.timer() + self.ttl
+        with self.lock:
+            self.cache[key] = (expires, cached)
+            if expires is not None:
+                self.expiring.append((expires, key))
+            while self.maxsize is not None and len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def _expire(self, now):
+        """ drop expired entries (ttl is the same for all, so the expiring deque is ordered by expires)"""
+        expiring = self.expiring
+        while expiring and expiring[0][0] <= now:
+            expires, key = expiring.popleft()
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] == expires:
+                del self.cache[key]
+                self.expirations += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "expirations": self.expirations, "uncached": self.uncached, "size": len(self.cache)}
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.expiring.clear()
+
+def memoize(f, maxsize=128, ttl=None, cache_failures=False):
+    return Memoized(f, maxsize=maxsize, ttl=ttl, cache_failures=cache_failures)
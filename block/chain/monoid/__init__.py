@@ -1 +1,42 @@
+from block.chain.monoid import mutable
 
+class _Folding(object):
+    """ accumulator for monoids not having mconcat"""
+    __slots__ = ["m"]
+    def __init__(self, m):
+        self.m = m
+
+    def append(self, other):
+        self.m = self.m.append(other)
+        return self
+
+def _folded(acc):
+    return acc.m
+
+class _Parts(object):
+    """ accumulator for monoids having mconcat. parts are concatenated at once"""
+    __slots__ = ["parts"]
+    def __init__(self, m):
+        self.parts = [m]
+
+    def append(self, other):
+        self.parts.append(other)
+        return self
+
+def _identity(acc):
+    return acc
+
+def accumulator(m):
+    """ (acc, result). acc.append(other) accumulates in place,
+    and result(acc) returns the accumulated value as the same class of m.
+
+    for copy-on-append monoids (block.chain.monoid.immutable),
+    appends are collected, and concatenated at once by mconcat at result(acc).
+    """
+    cls = m.__class__
+    if cls.__module__ == mutable.__name__:
+        return m, _identity
+    mconcat = getattr(cls, "mconcat", None)
+    if mconcat is None:
+        return _Folding(m), _folded
+    return _Parts(m), lambda acc: mconcat(acc.parts)
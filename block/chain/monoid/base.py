@@ -1,10 +1,38 @@
-from block.chain.interfaces import (
-    IMonoid,
-    IFalsyValue
-)
+import itertools
+import threading
 
-__all__ = ["IMonoid", "MonoidBase", 
-           "IFalsyValue", "FailureBase"]
+__all__ = ["MonoidBase", "FailureBase",
+           "Rope", "StringMonoidBase"]
+
+class Rope(object):
+    """ concatenation tree. leaves are tuples. concat is O(1), flattening is done at items()"""
+    __slots__ = ["left", "right"]
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    @classmethod
+    def concat(cls, left, right):
+        if not right:
+            return left
+        if not left:
+            return right
+        return cls(left, right)
+
+    @classmethod
+    def items(cls, rope):
+        if not isinstance(rope, cls):
+            return list(rope)
+        r = []
+        stack = [rope]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, cls):
+                stack.append(node.right)
+                stack.append(node.left)
+            else:
+                r.extend(node)
+        return r
 
 
 class MonoidBase(object):
@@ -24,24 +52,149 @@ class MonoidBase(object):
     def value(self):
         return self._value
 
+class StringMonoidBase(object):
+    """ strings are kept in a rope, and the joined value is memoized until the next append.
+    (after joining, the rope is collapsed into the joined string)
+    """
+    def __init__(self, value=None):
+        if isinstance(value,(str,unicode)):
+            self._rope = (value, )
+        elif isinstance(value, Rope):
+            self._rope = value
+        else:
+            self._rope = tuple(value or ())
+        self._cache = None
+
+    @classmethod
+    def mconcat(cls, ms):
+        """ concatenation of ms, joined at once"""
+        return cls(value=u"".join(itertools.chain.from_iterable(Rope.items(m._rope) for m in ms)))
+
+    @property
+    def _value(self):
+        return Rope.items(self._rope)
+
+    @property
+    def value(self):
+        if self._cache is None:
+            self._cache = u"".join(Rope.items(self._rope))
+            self._rope = (self._cache, )
+        return self._cache
+
+_shared_lock = threading.Lock()
+_NOT_JOINED = (0, None, u"")
+
+class SharedValues(object):
+    """ values shared by failures appended one after another (a failure of size n has items[:n]).
+    the failure owning the end of items extends it in place, and the others copy their prefix.
+    joined is (count, delimiter, text) of items[:count], so reading after appends joins only the new values.
+    """
+    __slots__ = ["items", "joined"]
+    def __init__(self, items, joined=_NOT_JOINED):
+        self.items = items
+        self.joined = joined
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("values of a failure are read-only (use append, or set values)")
+
+class FrozenValues(list):
+    """ values of a failure. a list, but not modifiable (it is a copy of values shared by failures)"""
+    __slots__ = []
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _read_only
+
 class FailureBase(object):
-    __slots__ = ["values", "delimiter"]
+    __slots__ = ["_shared", "_value", "size", "dropped", "delimiter"]
     def __init__(self, value=None, values=None, delimiter=u""):
         self.values = values or [value]
         self.delimiter = delimiter
+        self.dropped = 0
 
     @property
     def empty(self):
         return self.__class__("", delimiter=self.delimiter)
 
+    def _get_values(self):
+        """ read-only list of values (FrozenValues). set values, or append a failure to change them"""
+        return FrozenValues(itertools.islice(self._shared.items, self.size))
+
+    def _set_values(self, values):
+        self._shared = SharedValues(list(values))
+        self._value = None
+        self.size = len(self._shared.items)
+
+    values = property(_get_values, _set_values)
+
+    def _concat(self, other):
+        if other.size == 1:
+            extra = [other._shared.items[0]]
+        else:
+            extra = other._shared.items[:other.size]
+        with _shared_lock:
+            shared = self._shared
+            if len(shared.items) != self.size:
+                joined = shared.joined if shared.joined[0] <= self.size else _NOT_JOINED
+                shared = SharedValues(shared.items[:self.size], joined)
+            shared.items.extend(extra)
+            self._shared = shared
+        self._value = None
+        self.size += len(extra)
+        self.dropped += other.dropped
+
+    @classmethod
+    def mconcat(cls, failures):
+        """ concatenation of failures (at least one), with the delimiter of the first one"""
+        failures = list(failures)
+        if not failures:
+            raise TypeError("mconcat() of no failures")
+        failure = cls(values=(), delimiter=failures[0].delimiter)
+        failure.values = tuple(itertools.chain.from_iterable(f.values for f in failures))
+        failure.dropped = sum(f.dropped for f in failures)
+        return failure
+
+    def copy(self):
+        """ a new failure sharing values"""
+        failure = self.__class__.__new__(self.__class__)
+        failure._shared, failure.size, failure.dropped = self._shared, self.size, self.dropped
+        failure._value, failure.delimiter = self._value, self.delimiter
+        return failure
+
+    def truncate(self, limit):
+        """ failure having the first limit values (self if not exceeding, otherwise a copy).
+        the number of dropped values is counted on dropped"""
+        if self.size <= limit:
+            return self
+        failure = self.copy()
+        failure.values = self._shared.items[:limit]
+        failure.dropped = self.dropped + self.size - limit
+        return failure
+
     @property
     def value(self):
-        return self.delimiter.join([unicode(v) for v in self.values])
+        if self._value is None:
+            shared, size = self._shared, self.size
+            count, delimiter, text = shared.joined
+            if count > size or delimiter != self.delimiter:
+                count = 0
+            parts = [unicode(v) for v in shared.items[count:size]]
+            if count:
+                parts.insert(0, text)
+            self._value = self.delimiter.join(parts)
+            if size > shared.joined[0]:
+                shared.joined = (size, self.delimiter, self._value)
+        return self._value
 
     def __nonzero__(self):
         return False
     __bool__ = __nonzero__
 
+    def __reduce__(self):
+        return (self.__class__, (None, tuple(self.values), self.delimiter), self.dropped)
+
+    def __setstate__(self, dropped):
+        self.dropped = dropped
+
     def __repr__(self):
+        if self.dropped:
+            return u"{0}:{1}(+{2})".format(repr(self.__class__.__name__), repr(self.values), self.dropped)
         return u"{0}:{1}".format(repr(self.__class__.__name__), repr(self.values))
-
@@ -1,54 +1,61 @@
-from zope.interface import implementer
+import operator
+import functools
+import itertools
+from block.chain.declarations import implementer
 from .base import MonoidBase
-from .base import IMonoid, IFalsyValue
-from .base import FailureBase
+from .base import FailureBase, StringMonoidBase, Rope
 
-@implementer(IFalsyValue, IMonoid)
+@implementer("IFalsyValue", "IMonoid")
 class Failure(FailureBase):
-    __slots__ = ["values", "delimiter"]
+    __slots__ = []
     def append(self, other):
-        vs = self.values[:]
-        vs.extend(other.values)
-        return self.__class__(values=vs, delimiter=self.delimiter)
+        failure = self.copy()
+        failure._concat(other)
+        return failure
 
-@implementer(IMonoid)
+@implementer("IMonoid")
 class SumMonoid(MonoidBase):
     default = 0
     __slots__ = ["_value"]
+    @classmethod
+    def mconcat(cls, ms):
+        return cls(value=sum(m._value for m in ms))
+
     def append(self, other):
         value = self._value + other._value
         return self.__class__(value=value)
             
-@implementer(IMonoid)
+@implementer("IMonoid")
 class ProductMonoid(MonoidBase):
     default = 1
     __slots__ = ["_value"]
+    @classmethod
+    def mconcat(cls, ms):
+        return cls(value=functools.reduce(operator.mul, (m._value for m in ms), 1))
+
     def append(self, other):
         value = self._value * other._value
         return self.__class__(value=value)
             
 
-@implementer(IMonoid)
+@implementer("IMonoid")
 class ListMonoid(MonoidBase):
     __slots__ = ["_value"]
     def __init__(self, value=None):
         self._value = value or []
 
+    @classmethod
+    def mconcat(cls, ms):
+        return cls(value=list(itertools.chain.from_iterable(m._value for m in ms)))
+
     def append(self, other):
         value = self._value[:]
         value.extend(other._value)
         return self.__class__(value=value)
 
-@implementer(IMonoid)
-class StringMonoid(ListMonoid):
-    __slots__ = ["_value"]
-    def __init__(self, value=None):
-        if isinstance(value,(str,unicode)):
-            self._value = [value]
-        else:
-            self._value = value or []
-
-    @property
-    def value(self):
-        return u"".join(self._value)
+@implementer("IMonoid")
+class StringMonoid(StringMonoidBase, ListMonoid):
+    __slots__ = []
+    def append(self, other):
+        return self.__class__(value=Rope.concat(self._rope, other._rope))
 
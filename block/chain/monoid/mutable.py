@@ -1,51 +1,60 @@
-from zope.interface import implementer
+import operator
+import functools
+import itertools
+from block.chain.declarations import implementer
 from .base import MonoidBase
-from .base import IMonoid, IFalsyValue
-from .base import FailureBase
+from .base import FailureBase, StringMonoidBase, Rope
 
-@implementer(IFalsyValue, IMonoid)
+@implementer("IFalsyValue", "IMonoid")
 class Failure(FailureBase):
-    __slots__ = ["values", "delimiter"]
+    __slots__ = []
     def append(self, other):
-        self.values.extend(other.values)
+        self._concat(other)
         return self
 
-@implementer(IMonoid)
+@implementer("IMonoid")
 class SumMonoid(MonoidBase):
     default = 0
     __slots__ = ["_value"]
+    @classmethod
+    def mconcat(cls, ms):
+        return cls(value=sum(m._value for m in ms))
+
     def append(self, other):
         self._value += other._value
         return self
             
-@implementer(IMonoid)
+@implementer("IMonoid")
 class ProductMonoid(MonoidBase):
     default = 1
     __slots__ = ["_value"]
+    @classmethod
+    def mconcat(cls, ms):
+        return cls(value=functools.reduce(operator.mul, (m._value for m in ms), 1))
+
     def append(self, other):
         self._value *= other._value
         return self
 
-@implementer(IMonoid)
+@implementer("IMonoid")
 class ListMonoid(MonoidBase):
     __slots__ = ["_value"]
     def __init__(self, value=None):
         self._value = value or []
 
+    @classmethod
+    def mconcat(cls, ms):
+        return cls(value=list(itertools.chain.from_iterable(m._value for m in ms)))
+
     def append(self, other):
         self._value.extend(other._value)
         return self
 
-@implementer(IMonoid)
-class StringMonoid(ListMonoid):
-    __slots__ = ["_value"]
-    def __init__(self, value=None):
-        if isinstance(value,(str,unicode)):
-            self._value = [value]
-        else:
-            self._value = value or []
-
-    @property
-    def value(self):
-        return u"".join(self._value)
+@implementer("IMonoid")
+class StringMonoid(StringMonoidBase, ListMonoid):
+    __slots__ = []
+    def append(self, other):
+        self._rope = Rope.concat(self._rope, other._rope)
+        self._cache = None
+        return self
 
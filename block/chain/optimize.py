@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+"""
+optimization pass of ChainedQuery steps.
+
+  q.map(f).map(g).map(h).optimize()  # => q.map(Composed([f, g, h]))
+
+- consecutive single argument maps are fused into one map (Composed).
+- consecutive do steps are collapsed into one DoManyStep.
+- no-op steps are dropped (map(identity), do([])).
+
+the first step is kept as is, because only it receives the extra arguments of value().
+no-op steps are kept if they are the last step or followed by a direct step
+(on MaybeF/ErrorF, they resolve Any, and the value is seen as is by them).
+"""
+from block.chain import (
+    DO,
+    DO_MANY,
+    MAP,
+    DIRECT,
+    DoManyStep,
+    MapStep,
+    Steps,
+    Composed,
+    identity,
+    )
+
+def _maps(f):
+    return f.fs if isinstance(f, Composed) else (f, )
+
+def _dos(step):
+    return step.f if step.kind is DO_MANY else (step.f, )
+
+def _is_noop(step, following):
+    if following is None or following.kind is DIRECT:
+        return False
+    if step.kind is DO_MANY:
+        return not step.f
+    return step.kind is MAP and not step.args and step.f is identity
+
+def _merge(step, following):
+    """ one step equivalent to step and following, or None"""
+    if step.kind is MAP and following.kind is MAP and not step.args and not following.args:
+        return MapStep(Composed(_maps(step.f) + _maps(following.f)))
+    if step.kind in (DO, DO_MANY) and following.kind in (DO, DO_MANY):
+        return DoManyStep(_dos(step) + _dos(following))
+    return None
+
+def optimize_steps(steps):
+    """ tuple of equivalent steps"""
+    steps = list(steps)
+    if not steps:
+        return ()
+    r = [steps[0]]
+    rest = steps[1:]
+    for i, step in enumerate(rest):
+        following = rest[i + 1] if i + 1 < len(rest) else None
+        if _is_noop(step, following):
+            continue
+        if len(r) > 1 or r[0].kind is MAP:
+            merged = _merge(r[-1], step)
+            if merged is not None:
+                r[-1] = merged
+                continue
+        r.append(step)
+    return tuple(r)
+
+def optimize(query):
+    """ equivalent query with fewer steps"""
+    return query.__class__(Steps.from_iterable(optimize_steps(query.fs.items())))
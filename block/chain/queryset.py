@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+"""
+evaluating many queries sharing leading steps.
+
+  qs = QuerySet([q0, q1, q2])
+  qs.value(ctx, init)  # => [q0.value(ctx, init), q1.value(ctx, init), q2.value(ctx, init)]
+
+queries are merged into a trie by their identical leading steps (the same step object,
+or the same kind, function and arguments of the same types), and each shared prefix is evaluated once.
+a value consumed by more than one branch is passed through ctx.branches(v, n) (ctx.fork(v) by default),
+so branches updating values in place (mutable Failure, mutable monoids) or consuming them
+(iterators of LazyListF) don't see each other.
+each segment between branches runs on the compiled runner of the flavor.
+"""
+from block.chain import typed_key
+
+def _key(step):
+    key = (step.__class__, step.f, typed_key(step.args))
+    try:
+        hash(key)
+    except TypeError:  # unhashable arguments
+        return ("id", id(step))
+    return key
+
+class Node(object):
+    """ steps is the segment from the parent. ends are the indices of queries ending here"""
+    __slots__ = ["steps", "children", "ends", "_compiled", "_index"]
+    def __init__(self, steps=()):
+        self.steps = steps
+        self.children = []
+        self.ends = []
+        self._compiled = {}
+        self._index = {}
+
+    def child(self, step):
+        key = _key(step)
+        node = self._index.get(key)
+        if node is None:
+            node = self._index[key] = Node((step, ))
+            self.children.append(node)
+        return node
+
+    def compress(self):
+        """ merge chains of nodes having one child (and no ends) into one segment"""
+        for i, child in enumerate(self.children):
+            while len(child.children) == 1 and not child.ends:
+                grandchild = child.children[0]
+                grandchild.steps = child.steps + grandchild.steps
+                child = grandchild
+            self.children[i] = child
+            child.compress()
+        self._index = None
+
+    def runner(self, ctx):
+        run = self._compiled.get(ctx.__class__)
+        if run is None:
+            run = self._compiled[ctx.__class__] = ctx.compile_steps(self.steps)
+        return run
+
+    def count(self):
+        return len(self.steps) + sum(child.count() for child in self.children)
+
+class QuerySet(object):
+    def __init__(self, queries):
+        self.queries = list(queries)
+        self.root = Node()
+        for i, q in enumerate(self.queries):
+            node = self.root
+            for step in q.fs.items():
+                node = node.child(step)
+            node.ends.append(i)
+        self.root.compress()
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def steps(self):
+        """ the number of steps evaluated per input (sum(len(q.fs)) without sharing)"""
+        return self.root.count()
+
+    def value(self, ctx, init, *args, **kwargs):
+        """ results of the queries, in order. arguments are passed to the first step, as value()"""
+        results = [None] * len(self.queries)
+        stack = [(self.root, init, True)]
+        while stack:
+            node, v, first = stack.pop()
+            if node.steps:
+                if first:
+                    v = node.runner(ctx)(ctx, v, *args, **kwargs)
+                    first = False
+                else:
+                    v = node.runner(ctx)(ctx, v)
+            ## branches are taken before any branch runs
+            consumers = len(node.ends) + len(node.children)
+            vs = iter(ctx.branches(v, consumers) if consumers > 1 else [v])
+            for i in node.ends:
+                results[i] = next(vs)
+            for child in node.children:
+                stack.append((child, next(vs), first))
+        if ctx.finishing:
+            results = [ctx.finish(v) for v in results]
+        return results
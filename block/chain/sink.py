@@ -0,0 +1,94 @@
+# -*- coding:utf-8 -*-
+"""
+streaming output of WriterF.
+
+  M = WriterF(ListMonoid, sink=print_lines, batch=100, window=10)
+
+tell outputs are sent to the sink in batches (lists of monoid values) as they are told
+(also the identity, such as tell(0) on SumMonoid), and (m, v) keeps only a Window
+of the last outputs (DEFAULT_WINDOW if not given), so memory is bounded.
+listen and passing see the window. the rest is sent at the end of each run (value(), compile()),
+or by M.flush().
+"""
+import threading
+from collections import deque
+
+DEFAULT_WINDOW = 1000
+
+class Sink(object):
+    """ target is
+      a callable (called with a list of values),
+      a file-like object (each value is written as a line, by format),
+      or a queue (a list of values is put, blocking if a bounded queue is full).
+    """
+    def __init__(self, target, batch=100, format=u"{0}\n".format):
+        if hasattr(target, "put"):
+            self.write = target.put
+        elif hasattr(target, "write"):
+            self.write = lambda values: target.write(u"".join([format(v) for v in values]))
+        elif callable(target):
+            self.write = target
+        else:
+            raise TypeError("{0!r} is not a sink".format(target))
+        self.target = target
+        self.batch = batch
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def emit(self, value):
+        with self.lock:
+            self.buffer.append(value)
+            if len(self.buffer) < self.batch:
+                return
+            values, self.buffer = self.buffer, []
+        self.write(values)
+
+    def flush(self):
+        with self.lock:
+            values, self.buffer = self.buffer, []
+        if values:
+            self.write(values)
+
+class Window(object):
+    """ the last size outputs of tell (all if size is None), as a monoid (appended in place)"""
+    __slots__ = ["monoid", "parts"]
+    def __init__(self, monoid, parts=(), size=None):
+        self.monoid = monoid
+        self.parts = deque(parts, size)
+
+    def append(self, other):
+        if isinstance(other, Window):
+            self.parts.extend(list(other.parts))
+        else:
+            self.parts.append(other)
+        return self
+
+    def copy(self):
+        return self.__class__(self.monoid, self.parts, self.parts.maxlen)
+
+    def folded(self):
+        """ the window as a monoid of monoid class (concatenated at once if the class has mconcat)"""
+        if not self.parts:
+            return self.monoid.empty()
+        mconcat = getattr(self.monoid, "mconcat", None)
+        if mconcat is not None:
+            return mconcat(self.parts)
+        m = self.monoid.empty()
+        for part in self.parts:
+            m = m.append(part)
+        return m
+
+    @property
+    def value(self):
+        return self.folded().value
+
+    def __eq__(self, other):
+        if isinstance(other, Window):
+            other = other.folded()
+        return self.folded() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<Window {0!r}>".format(list(self.parts))
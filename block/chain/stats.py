@@ -0,0 +1,100 @@
+# -*- coding:utf-8 -*-
+"""
+per step instrumentation of ChainedQuery.
+
+  from block.chain import stats
+  stats.enable()                       # all ChainedQuery.value() calls are recorded on stats.registry
+  stats.registry.snapshot()            # => [{"step": "do:inc", "calls": .., "seconds": .., "failures": ..}, ...]
+  stats.Registry().run(q, ctx, init)   # recording only this call
+
+"failures" counts how many times the step is the origin of failure (Nothing/Failure),
+i.e. its input was not failed but its output was.
+when disabled, ChainedQuery.value pays one attribute check only.
+"""
+import time
+import weakref
+import threading
+from block.chain import ChainedQuery
+
+def describe(step):
+    f = step.f
+    if isinstance(f, tuple):
+        name = ",".join(getattr(g, "__name__", repr(g)) for g in f)
+    else:
+        name = getattr(f, "__name__", None) or f.__class__.__name__
+    return "{0}:{1}".format(step.kind, name)
+
+class StepStats(object):
+    __slots__ = ["name", "calls", "seconds", "failures"]
+    def __init__(self, step):
+        self.name = describe(step)  # not keeping the step alive
+        self.calls = 0
+        self.seconds = 0.0
+        self.failures = 0
+
+    def asdict(self):
+        return {"step": self.name, "calls": self.calls,
+                "seconds": self.seconds, "failures": self.failures}
+
+class Registry(object):
+    """ stats of steps. steps shared by queries (a common prefix) are recorded together.
+    records are dropped with their steps, and at most maxsize steps are recorded
+    (a record of some step is evicted to add another one).
+    """
+    def __init__(self, timer=time.time, maxsize=4096):
+        self.timer = timer
+        self.maxsize = maxsize
+        self.records = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def _record(self, step, seconds, failed):
+        with self.lock:
+            record = self.records.get(step)
+            if record is None:
+                if len(self.records) >= self.maxsize:
+                    self.records.popitem()
+                record = self.records[step] = StepStats(step)
+            record.calls += 1
+            record.seconds += seconds
+            if failed:
+                record.failures += 1
+
+    def run(self, query, ctx, init, *args, **kwargs):
+        """ same as query.value(ctx, init, *args, **kwargs), recording each step"""
+        failure_types = getattr(ctx, "failure_types", None)
+        timer = self.timer
+        v = init
+        failed = failure_types is not None and isinstance(v, failure_types)
+        for step in query.fs.items():
+            start = timer()
+            v = step(ctx, v, *args, **kwargs)
+            seconds = timer() - start
+            origin = not failed and failure_types is not None and isinstance(v, failure_types)
+            failed = failed or origin
+            self._record(step, seconds, origin)
+            if args or kwargs:
+                args, kwargs = (), {}
+        if ctx.finishing:
+            v = ctx.finish(v)
+        return v
+
+    def stats(self, query):
+        """ stats of the steps of query, in order"""
+        return [self.records[step].asdict() for step in query.fs.items() if step in self.records]
+
+    def snapshot(self):
+        with self.lock:
+            return [record.asdict() for record in self.records.values()]
+
+    def reset(self):
+        with self.lock:
+            self.records.clear()
+
+registry = Registry()
+
+def enable(target=None):
+    """ record all ChainedQuery.value() calls on target (default: registry)"""
+    ChainedQuery.stats = target or registry
+
+def disable():
+    ChainedQuery.stats = None
@@ -1,6 +1,15 @@
 def string_append(prefix, x):
     return prefix + x
 
+def triple_branch(ctx, x):
+    return [x, x+1, x]
+
+def double(x):
+    return x * 2
+
+class Y(object):
+    y = "y"
+
 from block.chain import chain
 
 def test_failure():
@@ -227,3 +236,911 @@ def test_any():
     assert Any(Failure("foo"), 20).choice(ErrorF()) == 20
     assert chain.chain.map(lambda x, y: x+y, Failure("y not found.")).value(ErrorF(), Failure("x not found.")).value == "x not found.y not found."
     assert chain.chain.map(lambda _, x, y: x+y, Failure("x not found."), Failure("y not found.")).value(ErrorF(), 10).value == "x not found.y not found."
+
+def test_compile():
+    from block.chain import (
+        MaybeF,
+        ErrorF,
+        ListF,
+        StateF,
+        WriterF,
+        Nothing,
+        Failure,
+        Any,
+        inc
+        )
+    from block.chain.monoid.immutable import ListMonoid
+
+    def stop(ctx, v):
+        return ctx.failure(v)
+    def add(n):
+        return lambda ctx, v: v + n
+
+    q = chain.chain.do(add(1), add(10)).map(lambda x : x * 2)
+    assert q.compile(MaybeF())(1) == q.value(MaybeF(), 1) == 24
+    assert q.compile(MaybeF()) is not q.compile(MaybeF())
+    assert len(q._compiled) == 1
+    assert chain.chain.do(add(1), add(10)).value(MaybeF(), 1) == 12
+    assert q.compile(MaybeF())(Nothing) == Nothing
+    assert q.compile(MaybeF())(Any(Nothing, 1)) == 24
+    assert chain.chain.do(stop).do(add(1)).compile(MaybeF())(1) == Nothing
+    assert chain.chain.do(chain["x"]["y"]).compile(MaybeF())({"x": {}}) == Nothing
+    assert chain.chain.do(stop).direct(lambda ctx, v: 10).do(add(1)).compile(MaybeF())(1) == 11
+
+    assert chain.chain.do(stop).map(lambda x : x + 1).compile(ErrorF())(1).value == "1"
+    assert chain.chain.map(lambda x, y: x + y, Failure("y")).compile(ErrorF())(Failure("x")).value == "xy"
+
+    def tri(ctx, x):
+        return [x, x+1, x]
+    M = ListF()
+    q = chain.chain.do(tri).do(tri).map(lambda x : x * 2)
+    assert q.compile(M)(M.unit(10)) == q.value(M, M.unit(10))
+
+    ctx = StateF()
+    q = chain.chain.do(inc).do(inc).map(lambda x, y : x + y, ctx.unit(1))
+    assert q.compile(ctx)(ctx.unit(10))(0) == q.value(ctx, ctx.unit(10))(0) == (2, 11)
+
+    M = WriterF(ListMonoid)
+    q = chain.chain.do(M.tell(["a"])).do(M.tell(["b"])).direct(M.listen)
+    assert q.compile(M)(M.unit(10)) == q.value(M, M.unit(10))
+
+def test_shared_steps():
+    from block.chain import MaybeF
+
+    def add(n):
+        return lambda ctx, v: v + n
+    base = chain.chain.do(add(1)).do(add(2))
+    left = base.do(add(10))
+    right = base.map(lambda x : x * 100)
+    assert left.fs.tail is base.fs
+    assert right.fs.tail is base.fs
+    assert len(base.fs) == 2 and len(left.fs) == 3
+    assert base.value(MaybeF(), 0) == 3
+    assert left.value(MaybeF(), 0) == 13
+    assert right.value(MaybeF(), 0) == 300
+
+    # materializing every intermediate query shares one buffer
+    qs = [chain.chain]
+    for i in range(50):
+        qs.append(qs[-1].do(add(i)))
+    for q in qs[1:]:
+        q.value(MaybeF(), 0)
+    assert all(q.fs.buffer() is qs[-1].fs.buffer() for q in qs[1:])
+    assert left.fs.items()[-1] is not right.fs.items()[-1]
+    assert list(right.fs) == list(right.fs.items())
+
+    q = chain.chain
+    for i in range(2000):
+        q = q.do(add(1))
+    assert q.value(MaybeF(), 0) == 2000
+
+def test_value_many():
+    from block.chain import MaybeF, ErrorF, ListF, Nothing, Failure
+    from block.chain.batch import vectorized
+
+    def half(ctx, x):
+        if x % 2:
+            return ctx.failure("odd: {0}".format(x))
+        return x // 2
+
+    q = chain.chain.map(vectorized(lambda xs: xs * 3 + 1)).do(half).map(lambda x : x + 1)
+    inits = [1, 2, Nothing, 3, 4]
+    r = q.value_many(MaybeF(), inits)
+    assert list(r) == [q.value(MaybeF(), v) for v in inits] == [3, Nothing, Nothing, 6, Nothing]
+    assert list(r.mask) == [True, False, False, True, False]
+    assert list(r.valid) == [3, 6]
+
+    inits = [1, 2, Failure("x"), 3]
+    r = q.value_many(ErrorF(), inits)
+    assert [getattr(v, "value", v) for v in r] == [3, "odd: 7", "x", 6]
+    q = chain.chain.map(lambda x, y: x + y, Failure("y"))
+    assert [v.value for v in q.value_many(ErrorF(), [1, Failure("x")])] == ["y", "xy"]
+
+    def tri(ctx, x):
+        return [x, x+1, x]
+    assert list(chain.chain.do(tri).value_many(ListF(), [[1], [2]])) == [[1, 2, 1], [2, 3, 2]]
+
+    # values are kept as they are, unless a vectorized step produced them
+    q = chain.chain.map(lambda x: x)
+    mixed = [1, "a", 2.5, True]
+    assert q.value_many(MaybeF(), mixed).valid == mixed
+    assert [type(v) for v in q.value_many(MaybeF(), mixed)] == [int, str, float, bool]
+    big = [3 * 2 ** 62, 2 ** 62]
+    assert list(q.value_many(MaybeF(), big)) == big
+    calls = []
+    def twice(xs):
+        calls.append(xs)
+        return xs * 2
+    q = chain.chain.map(vectorized(twice))
+    assert list(q.value_many(MaybeF(), big)) == [6 * 2 ** 62, 2 ** 63]  # out of int64, per element
+    assert list(q.value_many(MaybeF(), mixed)) == [2, "aa", 5.0, 2]
+    del calls[:]
+    assert list(q.value_many(MaybeF(), [2 ** 40, 1])) == [2 ** 41, 2] and len(calls) == 1
+    ## int64 semantics by default, exact with dtype=object
+    assert list(chain.chain.map(vectorized(lambda xs: xs ** 3)).value_many(MaybeF(), [2 ** 30])) == [0]
+    cube = vectorized(dtype=object)(lambda xs: xs ** 3)
+    assert list(chain.chain.map(cube).value_many(MaybeF(), [2 ** 30, 2 ** 70])) == [2 ** 90, 2 ** 210]
+
+def test_lazy_list_context():
+    from block.chain import ListF, LazyListF
+
+    def tri(ctx, x):
+        return [x, x+1, x]
+    q = chain.chain.do(tri).do(tri).map(lambda x, y : x * y, [1, 10])
+    M = LazyListF()
+    assert list(q.value(M, M.unit(10))) == q.value(ListF(), [10])
+    assert list(q.compile(M)(M.unit(10))) == q.value(ListF(), [10])
+
+    called = []
+    def tri_counted(ctx, x):
+        called.append(x)
+        return [x, x+1, x]
+    q = chain.chain.do(*[tri_counted] * 12)
+    assert M.take(2, q.value(M, M.unit(0))) == [0, 1]
+    assert len(called) == 12
+    assert M.first(chain.chain.do(lambda ctx, x: []).value(M, M.unit(0))) is None
+
+def test_parallel_list_context():
+    import multiprocessing
+    from block.chain import ListF, ParallelListF
+
+    q = chain.chain.do(triple_branch).do(triple_branch).do(triple_branch)
+    expected = q.value(ListF(), [10, 20])
+
+    serial = ParallelListF(executor=object(), threshold=100)
+    assert q.value(serial, [10, 20]) == expected
+
+    pool = multiprocessing.Pool(2)
+    try:
+        M = ParallelListF(executor=pool, chunksize=2, threshold=0)
+        assert q.value(M, [10, 20]) == expected
+        assert q.compile(M)([10, 20]) == expected
+    finally:
+        pool.close()
+        pool.join()
+
+    with ParallelListF(processes=2, chunksize=4, threshold=0, dedup=True) as M:
+        assert M.pruning
+        assert q.value(M, [10, 20]) == q.value(ListF(dedup=True), [10, 20])
+        pool = M.executor
+    assert M._executor is None
+    assert pool._state != multiprocessing.pool.RUN
+
+def test_long_state_chain():
+    from block.chain import StateF, inc
+
+    ctx = StateF()
+    q = chain.chain.do(*[inc] * 5000).map(lambda x : x + 1)
+    assert q.value(ctx, ctx.unit(10))(0) == (5000, 11)
+    assert chain.chain.do(*[inc] * 3).value(ctx, chain.chain.do(inc).value(ctx, ctx.unit(1)))(0) == (4, 1)
+
+def test_writer_accumulation():
+    from block.chain import WriterF
+    from block.chain.monoid import immutable, mutable
+
+    for module in [immutable, mutable]:
+        M = WriterF(module.ListMonoid)
+        q = chain.chain.do(*[M.tell(["x"])] * 100).direct(M.listen).do(M.tell(["y"]))
+        assert q.compile(M)(M.unit(10)) == q.value(M, M.unit(10))
+        m, (listened, v) = q.compile(M)(M.unit(10))
+        assert m.value == ["x"] * 100 + ["y"]
+        assert v == 10
+        if module is immutable:
+            assert listened.value == ["x"] * 100
+
+        M = WriterF(module.SumMonoid)
+        q = chain.chain.do(*[M.tell(2)] * 10)
+        assert q.compile(M)(M.unit(0)) == q.value(M, M.unit(0)) == (module.SumMonoid(20), 0)
+
+    init = immutable.ListMonoid(["a"])
+    M = WriterF(immutable.ListMonoid)
+    assert chain.chain.do(M.tell(["b"])).compile(M)((init, 0)) == (immutable.ListMonoid(["a", "b"]), 0)
+    assert init.value == ["a"]
+
+    ## value() carries a Log between steps too. direct steps and the result see the built monoid
+    from block.chain import Log
+    seen = []
+    def peek(ctx, (m, v)):
+        seen.append(m)
+        return (m, v)
+    q = chain.chain.do(M.tell(["b"]), M.tell(["c"])).direct(peek).do(M.tell(["d"]))
+    m, v = q.value(M, (init, 0))
+    assert m.value == ["a", "b", "c", "d"] and seen[0].value == ["a", "b", "c"]
+    assert not isinstance(seen[0], Log) and init.value == ["a"]
+    ## branches share the prefix without seeing each other
+    from block.chain.queryset import QuerySet
+    base = chain.chain.do(M.tell(["b"]))
+    rs = QuerySet([base.do(M.tell(["c"])), base.do(M.tell(["d"])), base]).value(M, (init, 0))
+    assert [m.value for m, v in rs] == [["a", "b", "c"], ["a", "b", "d"], ["a", "b"]]
+
+def test_rope_monoid():
+    from block.chain.monoid import immutable, mutable
+
+    for module in [immutable, mutable]:
+        m = module.StringMonoid("a")
+        for i in range(5000):
+            m = m.append(module.StringMonoid("b"))
+        assert m.value == "a" + "b" * 5000
+        assert m.value is m.value
+        m = m.append(m)
+        assert len(m.value) == 10002
+
+        f = module.Failure("x")
+        for i in range(5000):
+            f = f.append(module.Failure("y"))
+        assert f.value == "x" + "y" * 5000
+        assert f.values[:2] == ["x", "y"]
+        assert f.value is f.value
+
+    # reading between appends, and branching from a read failure
+    f = immutable.Failure("a", delimiter=",")
+    for c in "bcd":
+        f = f.append(immutable.Failure(c))
+        assert f.value == ",".join("abcd"[:f.size])
+    left, right = f.append(immutable.Failure("l")), f.append(immutable.Failure("r"))
+    assert (left.value, right.value, f.value) == ("a,b,c,d,l", "a,b,c,d,r", "a,b,c,d")
+    assert right.values == ["a", "b", "c", "d", "r"]
+    m = mutable.Failure("x")
+    m.append(m)
+    assert m.values == ["x", "x"]
+    import pytest
+    with pytest.raises(TypeError):
+        m.values.append("y")
+    m.values = m.values + ["y"]
+    assert m.values == ["x", "x", "y"] and m.value == "xxy"
+
+    f = mutable.Failure("x", delimiter=", ")
+    f.append(immutable.Failure("y"))
+    assert f.value == "x, y"
+    assert repr(f) == "'Failure':['x', 'y']"
+
+def test_virtualobject_path():
+    from block.chain import VirtualObject, MaybeF, ErrorF, Nothing
+
+    class A:
+        class x:
+            class y:
+                z = 10
+    base = VirtualObject().x
+    left = base.y.z
+    right = base.y
+    assert left.value(A) == 10
+    assert right.value(A) is A.x.y
+    assert base.value(A) is A.x
+    assert VirtualObject().x.y.z == left
+    assert len(set([left, VirtualObject().x.y.z, right])) == 2
+    assert left._compile() is VirtualObject().x.y.z._compile()
+
+    # paths equal but for the types of arguments are compiled separately, and the cache is bounded
+    import block.chain as c
+    o = {"x": {}}
+    assert VirtualObject()["x"].get("y", 1).value(o) == 1
+    assert type(VirtualObject()["x"].get("y", 1.0).value(o)) is float
+    assert VirtualObject()["x"].get("y", True).value(o) is True
+    assert VirtualObject()["x"].get("y", 1) != VirtualObject()["x"].get("y", 1.0)
+    assert len(set([VirtualObject()["x"].get("y", 1), VirtualObject()["x"].get("y", 1.0)])) == 2
+    for i in range(c._compiled_paths_maxsize + 10):
+        VirtualObject()["k{0}".format(i)]._compile()
+    assert len(c._compiled_paths) <= c._compiled_paths_maxsize
+    assert VirtualObject()["x"].get("y", 20).value({"x": {}}) == 20
+    assert VirtualObject().path.value(type("", (), {"path": 1})) == 1
+
+    path = chain.x.y.z
+    assert chain.chain.do(path).value(MaybeF(), A) == 10
+    assert chain.chain.do(path).value(MaybeF(), A.x) == Nothing
+    assert chain.chain.do(chain["x"].get("y")).value(ErrorF(), {"x": {"y": 1}}) == 1
+
+def test_async_context():
+    import time
+    import pytest
+    futures = pytest.importorskip("concurrent.futures")
+    from block.chain import AsyncF, Failure
+
+    executor = futures.ThreadPoolExecutor(4)
+    ctx = AsyncF(executor)
+
+    def slow(v, wait=0.2):
+        time.sleep(wait)
+        return v
+    def fetch(ctx, v):
+        return ctx.submit(slow, v + 1)
+    def broken(ctx, v):
+        return ctx.submit(lambda: {}["x"])
+
+    try:
+        assert chain.chain.do(fetch).do(fetch).value(ctx, 1).result() == 3
+
+        start = time.time()
+        q = chain.chain.do(fetch).map(lambda x, y, z: [x, y, z], ctx.submit(slow, 10), ctx.submit(slow, 20))
+        assert q.value(ctx, 1).result() == [2, 10, 20]
+        assert time.time() - start < 0.6
+
+        r = chain.chain.do(broken).do(fetch).value(ctx, 1).result()
+        assert repr(r) == "'Failure':[KeyError('x',)]"
+        r = chain.chain.map(lambda x, y: x + y, Failure("y")).value(ctx, ctx.submit(slow, Failure("x"), 0)).result()
+        assert r.value == "xy"
+
+        # a raising step becomes a failure, at the last step and in the middle
+        def raising(ctx, v):
+            raise ValueError(v)
+        for q in [chain.chain.do(fetch).do(raising), chain.chain.do(fetch).do(raising).do(fetch),
+                  chain.chain.do(broken)]:
+            r = q.value(ctx, 1).result()
+            assert isinstance(r, Failure) and isinstance(r.values[0], (ValueError, KeyError))
+    finally:
+        executor.shutdown()
+
+def test_concurrent_arguments():
+    import time
+    import pytest
+    futures = pytest.importorskip("concurrent.futures")
+    from block.chain import MaybeF, ErrorF, AsyncF, Nothing, Failure, Any, Thunk
+
+    def sleeping(v, wait):
+        time.sleep(wait)
+        return v
+    def slow(v, wait=0.2):
+        return Thunk(sleeping, v, wait)
+
+    executor = futures.ThreadPoolExecutor(4)
+    try:
+        ctx = MaybeF(executor=executor)
+        start = time.time()
+        q = chain.chain.map(lambda x, y, z, w: [x, y, z, w], slow(1), slow(2), slow(Any(Nothing, 3)))
+        assert q.value(ctx, 0) == [0, 1, 2, 3]
+        assert q.compile(ctx)(0) == [0, 1, 2, 3]
+        assert time.time() - start < 0.7
+        assert chain.chain.map(lambda x, y: [x, y], Thunk(lambda: {}["x"])).value(ctx, 0) == Nothing
+        # Any (callable as a do step) is an alternative value as an argument, also with executor
+        for ctx_ in [ctx, ErrorF(executor=executor)]:
+            q = chain.chain.map(lambda x, y: x + y, Any(ctx_.failure("y"), Any(ctx_.failure("z"), 2)))
+            assert q.value(ctx_, 1) == q.compile(ctx_)(1) == 3
+        # only Thunk is evaluated. other callables are values
+        assert chain.chain.map(lambda x, f: f(x), str).value(ctx, 1) == "1"
+        assert chain.chain.map(lambda x, y: x + y, slow(1, 0)).value(MaybeF(), 1) == 2
+
+        ctx = ErrorF(executor=executor)
+        q = chain.chain.map(lambda x, y, z: [x, y, z], slow(Failure("y"), 0.2), slow(Failure("z"), 0))
+        assert q.value(ctx, Failure("x")).value == "xyz"
+        ys = ctx.chain(Failure("y")).choice_another(Failure("z"))
+        assert chain.chain.map(lambda x, y: x + y, ys).value(ctx, 10).value == "yz"
+        assert chain.chain.map(lambda x, y: x + y, ctx.chain(Failure("y")).choice_another(1)).value(ctx, 10) == 11
+
+        # AsyncF passes callables as they are, and awaits thunks without blocking a single worker
+        single = futures.ThreadPoolExecutor(1)
+        try:
+            ctx = AsyncF(single)
+            assert chain.chain.map(lambda x, f: f(x), str).value(ctx, 1).result() == "1"
+            q = chain.chain.map(lambda x, y, z: x + y + z, slow(1, 0.05), slow(2, 0))
+            assert q.value(ctx, ctx.submit(sleeping, 10, 0)).result(timeout=5) == 13
+        finally:
+            single.shutdown()
+        # the same arguments are evaluated with and without executor
+        M = MaybeF()
+        q = chain.chain.map(lambda x, y: (x, y), M.chain(5))
+        assert q.value(MaybeF(), 1) == q.value(MaybeF(executor=executor), 1) == (1, 5)
+        # AsyncF without executor evaluates thunks inline
+        assert chain.chain.map(lambda x, y: x + y, slow(1, 0)).value(AsyncF(), 1).result() == 2
+    finally:
+        executor.shutdown()
+
+def test_stats():
+    from block.chain import MaybeF, ErrorF, Nothing
+    from block.chain import stats
+
+    def inc(ctx, v):
+        return v + 1
+    def stop(ctx, v):
+        return ctx.failure(v)
+
+    q = chain.chain.do(inc).do(stop).map(lambda x : x * 2)
+    registry = stats.Registry()
+    assert registry.run(q, MaybeF(), 1) == Nothing
+    assert registry.run(q, ErrorF(), 1).value == "2"
+    assert registry.run(q, MaybeF(), Nothing) == Nothing
+    rows = registry.stats(q)
+    assert [(r["step"], r["calls"], r["failures"]) for r in rows] == [
+        ("do:inc", 3, 0), ("do:stop", 3, 2), ("map:<lambda>", 3, 0)]
+
+    stats.enable()
+    try:
+        stats.registry.reset()
+        q.value(MaybeF(), 1)
+        q.compile(MaybeF())(1)
+        assert [r["calls"] for r in stats.registry.stats(q)] == [2, 2, 2]
+    finally:
+        stats.disable()
+    q.value(MaybeF(), 1)
+    assert [r["calls"] for r in stats.registry.stats(q)] == [2, 2, 2]
+
+    # records do not keep steps alive, and are bounded
+    import gc
+    registry = stats.Registry(maxsize=2)
+    registry.run(q, MaybeF(), 1)
+    assert len(registry.records) == 2
+    registry.run(chain.chain.do(inc), MaybeF(), 1)
+    gc.collect()
+    assert len(registry.records) <= 2 and all(step in q.fs for step in registry.records.keys())
+
+def test_memoize():
+    from block.chain import MaybeF, ErrorF, Nothing
+    from block.chain.memo import Memoized
+
+    called = []
+    def square(ctx, v):
+        called.append(v)
+        if v < 0:
+            return ctx.failure(v)
+        return v * v
+
+    step = chain.memoize(square, maxsize=2)
+    q = chain.chain.do(step)
+    assert [q.value(MaybeF(), v) for v in [1, 2, 1, 3, 2]] == [1, 4, 1, 9, 4]
+    assert called == [1, 2, 3, 2]
+    assert step.stats()["hits"] == 1 and step.stats()["evictions"] == 2
+    q.value(ErrorF(), 3)
+    assert called[-1] == 3  # cached per flavor
+
+    assert q.value(MaybeF(), -1) == q.value(MaybeF(), -1) == Nothing
+    assert called.count(-1) == 2
+    step = chain.memoize(square, cache_failures=True)
+    assert chain.chain.do(step).value(MaybeF(), -1) == chain.chain.do(step).value(MaybeF(), -1) == Nothing
+    assert called.count(-1) == 3
+    step = chain.memoize(lambda ctx, v: len(v))
+    assert chain.chain.do(step).value(MaybeF(), [1, 2]) == 2
+    assert step.stats()["uncached"] == 1
+
+    now = [0]
+    step = Memoized(square, ttl=10, timer=lambda: now[0])
+    step(MaybeF(), 5)
+    now[0] = 5
+    step(MaybeF(), 5)
+    now[0] = 20
+    step(MaybeF(), 5)
+    assert step.stats()["expirations"] == 1 and called.count(5) == 2
+    # expired entries are dropped without being looked up again
+    for v in range(10, 20):
+        step(MaybeF(), v)
+    now[0] = 40
+    step(MaybeF(), 10)
+    assert step.stats()["size"] == 1
+
+    # equal values of different types are cached separately
+    step = chain.memoize(lambda ctx, v: v)
+    assert [type(step(MaybeF(), v)) for v in [1, 1.0, True]] == [int, float, bool]
+    assert type(step(MaybeF(), (1, 2.0))[1]) is float and type(step(MaybeF(), (1, 2))[1]) is int
+
+    q = chain.chain.do(square, memo={"maxsize": 10})
+    q.value(MaybeF(), 7)
+    q.value(MaybeF(), 7)
+    assert called.count(7) == 1
+    assert q.fs[0].f.stats()["hits"] == 1
+
+    # iterators and mutable failures are not shared with the cache
+    from block.chain import LazyListF, ListF, Any
+    step = chain.memoize(lambda ctx, v: iter([v, v + 1]))
+    for ctx in [LazyListF(), ListF(limit=5)]:
+        q = chain.chain.do(step)
+        assert [list(q.value(ctx, [1])) for _ in range(3)] == [[1, 2]] * 3
+    step = chain.memoize(lambda ctx, v: ctx.failure(v), cache_failures=True)
+    q = chain.chain.do(Any(step, lambda ctx, v: ctx.failure("x")))
+    assert [q.value(ErrorF(), "a").value for _ in range(3)] == ["ax"] * 3
+
+def test_lazy_any():
+    from block.chain import MaybeF, ErrorF, Nothing, Failure, Any, Thunk
+
+    called = []
+    def source(name, value):
+        def fetch(ctx, k):
+            called.append(name)
+            return value if value is not None else ctx.failure("{0} miss {1}. ".format(name, k))
+        return fetch
+
+    q = chain.chain.do(Any(source("cache", None), source("replica", 10), source("primary", 20)))
+    assert q.value(MaybeF(), "k") == 10
+    assert called == ["cache", "replica"]
+    del called[:]
+    assert q.compile(MaybeF())("k") == 10
+
+    q = chain.chain.do(Any(source("cache", None), chain.chain.do(source("replica", None)).map(lambda x : x + 1)))
+    assert q.value(ErrorF(), "k").value == "cache miss k. replica miss k. "
+    assert q.value(MaybeF(), Nothing) == Nothing
+
+    del called[:]
+    def thunk(name, value):
+        def get():
+            called.append(name)
+            return value
+        return Thunk(get)
+    assert chain.chain.map(lambda x, y: x + y, Any(thunk("a", Nothing), thunk("b", 1), thunk("c", 2))).value(MaybeF(), 10) == 11
+    assert called == ["a", "b"]
+    assert Any(Thunk(lambda: {}["x"]), Failure("y")).choice(ErrorF()).values[1:] == ["y"]
+    # other callables are values
+    assert chain.chain.map(lambda x, f: f(x), Any(Nothing, str)).value(MaybeF(), 1) == "1"
+
+def test_capture_policy():
+    from block.chain import ErrorF, Failure
+    from block.chain.capture import CapturePolicy, FailureRecord
+
+    policy = CapturePolicy(limit=3)
+    ctx = ErrorF(policy=policy)
+    r1 = chain.chain.do(chain["x"]).value(ctx, {})
+    r2 = chain.chain.do(chain["x"]).value(ctx, {})
+    record = r1.values[0]
+    assert isinstance(record, FailureRecord)
+    assert record.type == "KeyError" and record.message == "'x'"
+    assert record.location[0].endswith(".py") and record.location[1] > 0
+    assert r2.values[0] is record
+    assert r1.value == "'x'"
+
+    q = chain.chain.map(lambda *xs: xs, *[Failure(str(i)) for i in range(5)])
+    r = q.value(ctx, Failure("x"))
+    assert r.values == ["x", "0", "1"] and r.dropped == 3
+    assert repr(r) == "'Failure':['x', '0', '1'](+3)"
+    r = q.value(ErrorF(mutable=False, policy=CapturePolicy(limit=2)), Failure("x"))
+    assert r.values == ["x", "0"] and r.dropped == 4
+
+    # failures passing through map are kept as they are, by value() and compile() alike
+    ctx = ErrorF(policy=CapturePolicy(limit=1))
+    q = chain.chain.do(lambda ctx, v: Failure(values=["a", "b", "c"])).map(lambda x: x)
+    assert q.value(ctx, 0).values == q.compile(ctx)(0).values == ["a", "b", "c"]
+    q = chain.chain.map(lambda x, y: x, Failure(values=["a", "b", "c"]))
+    assert q.value(ctx, 0).values == q.compile(ctx)(0).values == ["a", "b", "c"]
+
+    ctx = ErrorF(policy=CapturePolicy(compact=False, fail_fast=True))
+    assert q.value(ctx, Failure("x")).values == ["x"]
+    assert chain.chain.map(lambda x, y, z: x, 1, Failure("y"), Failure("z")).value(ctx, 0).values == ["y"]
+    assert isinstance(chain.chain.do(chain["x"]).value(ctx, {}).values[0], KeyError)
+
+def test_lazy_interfaces():
+    import sys
+    import os
+    import subprocess
+    script = "\n".join([
+        "import sys",
+        "import block.chain",
+        "assert 'zope.interface' not in sys.modules and 'pkg_resources' not in sys.modules",
+        "from block.chain.interfaces import IQuery, IVirtualAccess, IMonoid",
+        "from block.chain.monoid.immutable import SumMonoid",
+        "assert IQuery.providedBy(block.chain.chain.chain)",
+        "assert IVirtualAccess.providedBy(block.chain.IdentityAccess)",
+        "assert IMonoid.implementedBy(SumMonoid)",
+        ])
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    assert subprocess.call([sys.executable, "-c", script], cwd=root) == 0
+
+    from block.chain.interfaces import IExecuteFlavor, IFalsyValue
+    from block.chain import ErrorF, Nothing
+    assert IExecuteFlavor.providedBy(ErrorF())
+    assert IFalsyValue.providedBy(Nothing)
+
+def test_pickle_query():
+    import pickle
+    import multiprocessing
+    from block.chain import MaybeF, ErrorF, VirtualObject
+
+    q = (chain.chain.do(chain["x"].y, chain(string_append, "a"))
+         .do([chain(double), chain(double)])
+         .map(string_append, "b"))
+    data = pickle.dumps(q, 2)
+    assert "<lambda>" not in data
+    q2 = pickle.loads(data)
+    assert pickle.loads(data) is q2
+    assert q2.spec() == q.spec()
+
+    for ctx in (MaybeF(), ErrorF()):
+        assert q2.value(ctx, {"x": Y()}) == q.value(ctx, {"x": Y()}) == "yayayayab"
+    assert q2.value(MaybeF(), {}) is q.value(MaybeF(), {})
+    import operator
+    div = [pickle.loads(pickle.dumps(chain.chain.map(operator.truediv, d), 2)) for d in (2, 2.0)]
+    div += [pickle.loads(pickle.dumps(chain.chain.map(operator.div, d), 2)) for d in (2, 2.0)]
+    assert [d.value(MaybeF(), 7) for d in div] == [3.5, 3.5, 3, 3.5]
+
+    vo = VirtualObject().x[0]
+    assert pickle.loads(pickle.dumps(vo)) == vo
+    failure = ErrorF(mutable=False).failure("x").append(ErrorF().failure("y"))
+    failure.dropped = 1
+    assert repr(pickle.loads(pickle.dumps(failure))) == repr(failure)
+
+    pool = multiprocessing.Pool(2)
+    try:
+        inits = [{"x": Y()}, {}] * 3
+        expected = [q.value(ErrorF(), v) for v in inits]
+        r = q.value_parallel(ErrorF(), inits, pool, chunksize=2)
+        assert [repr(x) for x in r] == [repr(x) for x in expected]
+    finally:
+        pool.close()
+        pool.join()
+
+def test_optimize():
+    import pickle
+    from block.chain import MaybeF, ErrorF, ListF, StateF, WriterF, Nothing, Any, identity, inc
+    from block.chain.monoid.immutable import ListMonoid
+
+    add1 = lambda x: x + 1
+    q = chain.chain.map(add1).map(identity).map(double).do([]).map(add1)
+    o = q.optimize()
+    assert len(o.fs) == 1 and o.fs[0].f.fs == (add1, double, add1)
+    for ctx, init in [(MaybeF(), 1), (ErrorF(), 1), (ListF(), [1, 2]), (WriterF(ListMonoid), (ListMonoid([]), 1))]:
+        assert o.value(ctx, init) == q.value(ctx, init) == o.compile(ctx)(init)
+    ctx = StateF()
+    assert o.value(ctx, ctx.unit(1))(0) == q.value(ctx, ctx.unit(1))(0) == (0, 5)
+
+    ## values are checked between fused maps on MaybeF
+    q = chain.chain.map(add1).map(lambda x: Nothing if x > 1 else Any(Nothing, x)).map(add1)
+    o = q.optimize()
+    assert len(o.fs) == 1
+    for v in (0, 1, Nothing):
+        assert o.value(MaybeF(), v) == q.value(MaybeF(), v) == o.compile(MaybeF())(v)
+
+    ## do steps are collapsed, except the first one (it receives the arguments of value())
+    def add(ctx, v, n=1):
+        return v + n
+    q = chain.chain.do(add).do(add).map(identity).do(add, [add, add]).map(identity)
+    o = q.optimize()
+    assert [s.kind for s in o.fs] == ["do", "do*", "map"]
+    assert o.value(MaybeF(), 0, n=10) == q.value(MaybeF(), 0, n=10) == 14
+    st = chain.chain.do(inc).do(inc).do(inc)
+    assert st.optimize().value(StateF(), StateF().unit(0))(0) == (3, 0)
+    assert len(pickle.loads(pickle.dumps(chain.chain.map(double).map(double).optimize())).fs) == 1
+
+    ## long runs of maps are fused without deep nesting
+    q = chain.chain
+    for i in range(500):
+        q = q.map(add1)
+    o = q.optimize()
+    assert len(o.fs) == 1
+    for ctx, init, expected in [(MaybeF(), 0, 500), (ListF(), [0, 1], [500, 501])]:
+        assert o.value(ctx, init) == o.compile(ctx)(init) == q.value(ctx, init) == expected
+
+def test_state_cell():
+    from block.chain import StateF, inc, put, get
+
+    def add(ctx, v, n=1):
+        return lambda s: (s + n, v + n)
+
+    q = (chain.chain.do(add).do(inc, [inc, get]).map(lambda x, y: x * 10 + y, StateF().unit(3))
+         .do(put(100)).do(add).do(inc).do(get))
+    for cell in (False, True):
+        ctx = StateF(cell=cell)
+        assert q.value(ctx, ctx.unit(1), n=5)(0) == (102, 102)
+        assert q.compile(ctx)(ctx.unit(1), n=5)(0) == (102, 102)
+        assert chain.chain.do(inc).do(get).value(ctx, ctx.unit(None))(1) == (2, 2)
+        assert chain.chain.value(ctx, ctx.unit(1))(0) == (0, 1)
+
+def test_list_pruning():
+    from block.chain import ListF, LazyListF
+
+    def branch(ctx, x):
+        return [x, x + 1, x]
+
+    q = chain.chain.do(branch).do(branch).do(branch)
+    assert len(q.value(ListF(), [0])) == 27
+
+    for run in (lambda ctx, init: q.value(ctx, init), lambda ctx, init: q.compile(ctx)(init)):
+        assert run(ListF(dedup=True), [0]) == [0, 1, 2, 3]
+        assert run(ListF(dedup=lambda x: x % 2), [0]) == [0, 1]
+        assert run(ListF(beam=2), [0]) == [2, 3]
+        assert run(ListF(beam=2, key=lambda x: -x), [0]) == [0, 0]
+        assert run(ListF(dedup=True, beam=2, key=lambda x: -x), [0]) == [0, 1]
+        assert run(ListF(limit=4), [0]) == [0, 1, 0, 1]
+
+    ## unhashable values are kept as is
+    assert chain.chain.do(lambda ctx, x: [x, x]).value(ListF(dedup=True), [[1]]) == [[1], [1]]
+
+    calls = []
+    def counted(ctx, x):
+        calls.append(x)
+        return [x, x + 1]
+    assert chain.chain.do(counted).do(counted).value(ListF(limit=2), [0, 10, 20]) == [0, 1]
+    assert calls == [0, 0]
+
+    q = chain.chain.map(lambda x, y: x + y, range(1000))
+    assert q.value(ListF(limit=3), range(1000)) == q.compile(ListF(limit=3))(range(1000)) == [0, 1, 2]
+    assert q.value(ListF(dedup=True, limit=5), range(1000)) == [0, 1, 2, 3, 4]
+
+    # map with arguments reads its input lazily too
+    del calls[:]
+    q = chain.chain.do(counted).do(counted).map(lambda x, y: x + y, [0])
+    assert q.value(ListF(limit=1), range(1000)) == q.compile(ListF(limit=1))(range(1000)) == [0]
+    assert calls == [0, 0] * 2
+
+    xs = chain.chain.do(branch).do(branch).value(LazyListF(dedup=True, limit=2), iter([0]))
+    assert list(xs) == [0, 1]
+
+    ## limit is applied to the results, not to each step
+    expand = lambda ctx, x: [x, x + 1]
+    only_big = lambda ctx, x: [x] if x >= 10 else []
+    q = chain.chain.do(expand).do(only_big)
+    for M in (ListF(limit=2), LazyListF(limit=2)):
+        assert list(q.value(M, [0, 10, 20])) == list(q.compile(M)([0, 10, 20])) == [10, 11]
+
+    ## fused maps are pruned per map, as written
+    neg = lambda x: -x
+    q = chain.chain.map(neg).map(neg)
+    for M in (ListF(beam=1), LazyListF(beam=1)):
+        for query in (q, q.optimize()):
+            assert list(query.value(M, [1, 2])) == list(query.compile(M)([1, 2])) == [1]
+
+def test_queryset():
+    from block.chain import MaybeF, ErrorF, ListF, StateF, WriterF, inc, Failure
+    from block.chain.queryset import QuerySet
+    from block.chain.monoid.mutable import ListMonoid
+
+    calls = []
+    def counted(ctx, v):
+        calls.append(v)
+        return ctx.lifted(lambda x: x + 1, v)
+
+    base = chain.chain.do(counted).do(counted)
+    qs = [base.map(double), base.do(counted), chain.chain.do(counted).do(counted).map(str), base, chain.chain]
+    queryset = QuerySet(qs)
+    assert queryset.steps == 5
+    assert queryset.value(MaybeF(), 1) == [6, 4, "3", 3, 1]
+    assert len(calls) == 3
+    assert queryset.value(ListF(), [1, 2]) == [q.value(ListF(), [1, 2]) for q in qs]
+    ctx = StateF()
+    assert [a(0) for a in QuerySet([chain.chain.do(inc), chain.chain.do(inc).do(inc)]).value(ctx, ctx.unit(1))] == [(1, 1), (2, 1)]
+
+    ## mutable failures are forked for each branch
+    fail = lambda ctx, v: ctx.failure(v)
+    qs = [chain.chain.do(fail).map(string_append, Failure("a")), chain.chain.do(fail).map(string_append, Failure("b")),
+          chain.chain.do(fail)]
+    assert [r.values for r in QuerySet(qs).value(ErrorF(), "x")] == [["x", "a"], ["x", "b"], ["x"]]
+
+    ## mutable monoids too
+    tell = lambda w: lambda ctx, v: (ListMonoid([w]), v)
+    ctx = WriterF(ListMonoid)
+    told = chain.chain.do(tell(1))
+    qs = [told.do(tell(2)), told.do(tell(3))]
+    assert [m.value for m, v in QuerySet(qs).value(ctx, (ListMonoid([]), 0))] == [[1, 2], [1, 3]]
+
+    ## arguments of value() are passed to the first step
+    def add(ctx, v, n=0):
+        return v + n
+    qs = QuerySet([chain.chain.do(add).map(double), chain.chain.do(add)])
+    assert qs.value(MaybeF(), 1, n=2) == [6, 3]
+
+    ## arguments equal but of different types are different steps
+    import operator
+    qs = [chain.chain.map(operator.div, 2), chain.chain.map(operator.div, 2.0),
+          chain.chain.do(chain(operator.div, 2)), chain.chain.do(chain(operator.div, 2.0))]
+    assert QuerySet(qs).steps == 4
+    assert QuerySet(qs).value(MaybeF(), 7) == [3, 3.5, 3, 3.5]
+
+    ## iterators of lazy flavors are split for each branch
+    from block.chain import LazyListF
+    branch = lambda ctx, x: [x, x + 1]
+    base = chain.chain.do(branch)
+    qs = [base.map(double), base, base.do(branch), chain.chain]
+    for M in (LazyListF(), LazyListF(dedup=True), ListF(limit=3)):
+        expected = [list(q.value(M, iter([0]))) for q in qs]
+        assert [list(r) for r in QuerySet(qs).value(M, iter([0]))] == expected
+        assert expected[1] == [0, 1]
+
+def test_extract_columns():
+    import array
+    from block.chain import MaybeF, Nothing
+    from block.chain import batch
+    from block.chain.batch import extract
+
+    class User(object):
+        def __init__(self, name):
+            self.name = name
+
+        @property
+        def broken(self):
+            raise ValueError("broken")
+
+    records = [{"user": User("foo"), "age": 20, "score": 1.5},
+               {"user": User("bar"), "age": 30.5},
+               {"age": Nothing, "score": True},
+               [1, 2]]
+    paths = [chain["user"].name, chain["age"], chain["score"], chain["user"].broken, chain["user"].name.upper()]
+    cols = extract(paths, records)
+    assert cols.names() == ["user.name", "age", "score", "user.broken", "user.name.upper"]
+    for vo, column in zip(paths, cols):
+        assert column.tolist() == [chain.chain.do(vo).value(MaybeF(), r) for r in records]
+    assert list(cols["age"].mask) == [True, True, False, False]
+    assert list(cols["age"].values)[:2] == [20, 30.5]
+    assert cols["user.name"].values[:2] == ["foo", "bar"]
+
+    cols = extract({"x": chain["x"]}, iter([{"x": 1}, {}, {"x": 3}]))
+    assert list(cols["x"].values) == [1, 0, 3] and len(cols) == 3
+
+    ## ints not exact as float are not mixed into a float column
+    records = [{"x": 2 ** 60 + 1}, {"x": 0.5}]
+    cols = extract({"x": chain["x"]}, records)
+    assert cols["x"].tolist() == [2 ** 60 + 1, 0.5] == [chain.chain.do(chain["x"]).value(MaybeF(), r) for r in records]
+    assert type(cols["x"].tolist()[0]) is int
+    assert extract({"x": chain["x"]}, [{"x": 2 ** 53}, {"x": 0.5}])["x"].values.dtype.kind == "f"
+
+    np, batch.np = batch.np, None
+    try:
+        cols = extract({"x": chain["x"], "ok": chain["ok"]}, [{"x": 1, "ok": True}, {}])
+    finally:
+        batch.np = np
+    assert cols["x"].values == array.array("l", [1, 0])
+    assert cols["x"].mask == array.array("b", [1, 0])
+    assert cols["ok"].values == array.array("b", [1, 0])
+
+def test_writer_sink():
+    import io
+    import Queue
+    from block.chain import WriterF
+    from block.chain.monoid.immutable import ListMonoid, SumMonoid, StringMonoid
+
+    batches = []
+    M = WriterF(ListMonoid, sink=batches.append, batch=2, window=2)
+    q = chain.chain.do(*[M.tell([i]) for i in range(4)]).direct(M.listen).do(M.tell([4]))
+    for run in (lambda init: q.value(M, init), lambda init: q.compile(M)(init)):
+        del batches[:]
+        m, (listened, v) = run(M.unit(10))
+        assert batches == [[[0], [1]], [[2], [3]], [[4]]]  # the rest is flushed at the end
+        M.flush()
+        assert batches == [[[0], [1]], [[2], [3]], [[4]]]
+        assert m.value == [3, 4] and v == 10
+
+    def double(m, v):
+        return m.append(m)
+    M = WriterF(StringMonoid, sink=lambda values: None, window=3)
+    q = chain.chain.do(M.tell("a"), M.tell("b")).direct(M.passing(double)).do(M.tell("c"))
+    assert q.value(M, M.unit(0))[0].value == q.compile(M)(M.unit(0))[0].value == "abc"
+    assert q.compile(M)(M.unit(0))[0] == StringMonoid("abc")
+
+    out = io.StringIO()
+    M = WriterF(SumMonoid, sink=out, batch=3)
+    m, v = chain.chain.do(*[M.tell(i) for i in range(5)]).value(M, M.unit(None))
+    assert out.getvalue() == u"0\n1\n2\n3\n4\n" and m.value == 10  # the identity is sent too
+
+    ## the window is bounded by default
+    from block.chain.sink import DEFAULT_WINDOW
+    M = WriterF(ListMonoid, sink=lambda values: None)
+    q = chain.chain.do(*[M.tell([i]) for i in range(DEFAULT_WINDOW + 5)])
+    for m, v in [q.value(M, M.unit(0)), q.compile(M)(M.unit(0))]:
+        assert len(m.parts) == DEFAULT_WINDOW and m.value == list(range(5, DEFAULT_WINDOW + 5))
+
+    queue = Queue.Queue(maxsize=10)
+    M = WriterF(ListMonoid, sink=queue, batch=2, window=0)
+    m, v = chain.chain.do(*[M.tell(["x"])] * 3).compile(M)(M.unit(0))
+    M.flush()
+    assert [queue.get_nowait() for i in range(queue.qsize())] == [[["x"], ["x"]], [["x"]]]
+    assert m.value == []
+
+    ## emitted from threads, every value is written once, in full batches
+    import threading
+    from block.chain.sink import Sink
+    batches = []
+    sink = Sink(batches.append, batch=10)
+    threads = [threading.Thread(target=lambda i=i: [sink.emit((i, j)) for j in range(1000)]) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sink.flush()
+    assert sorted(v for b in batches for v in b) == [(i, j) for i in range(4) for j in range(1000)]
+    assert all(len(b) == 10 for b in batches)
+
+def test_mconcat():
+    from block.chain import ErrorF, Failure
+    from block.chain.monoid import immutable, mutable
+
+    for module in (immutable, mutable):
+        assert module.SumMonoid.mconcat(module.SumMonoid(i) for i in range(5)).value == 10
+        assert module.SumMonoid.mconcat([]) == module.SumMonoid.empty()
+        assert module.ProductMonoid.mconcat(module.ProductMonoid(i) for i in range(1, 5)).value == 24
+        ms = [module.ListMonoid([i, i]) for i in range(3)]
+        assert module.ListMonoid.mconcat(ms).value == [0, 0, 1, 1, 2, 2]
+        assert ms[0].value == [0, 0]
+        s = module.StringMonoid("a").append(module.StringMonoid("b"))
+        assert module.StringMonoid.mconcat([s, module.StringMonoid("c")]).value == "abc"
+
+        failures = [module.Failure("x", delimiter=","), module.Failure("y"), module.Failure(values=["z", "w"])]
+        failure = module.Failure.mconcat(failures)
+        assert failure.values == ["x", "y", "z", "w"] and failure.value == "x,y,z,w"
+        assert failures[0].values == ["x"]
+
+    q = chain.chain.map(lambda *xs: xs, *[Failure(str(i)) for i in range(3)])
+    v = Failure("v")
+    assert q.value(ErrorF(), v).values == ["v", "0", "1", "2"]
+    assert v.values == ["v"]
@@ -23,7 +23,6 @@ setup(name='block.chain',
       author='podhmo',
       package_dir={'': '.'},
       packages=find_packages('.'),
-      namespace_packages=["block"],
       install_requires = requires,
       cmdclass = {'test': PyTest},
       tests_require=["pytest"],